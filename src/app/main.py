@@ -3,18 +3,21 @@ import os
 import sys
 import pandas as pd
 import json
-from sqlalchemy.orm import sessionmaker
 
 # Add project root to sys path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-from src.config import LOCAL_DATA_DIR
-from src.collector.metadata_store import MetadataStore, ImageMetadata
-from src.inference.predictor import ModelPredictor
+from src.config import LOCAL_DATA_DIR, INFERENCE_URL, INPUT_SIZE, THUMBNAIL_SIZE
+from src.collector.metadata_store import MetadataStore
+from src.processing.tensor_store import slice_exists, load_slice, pick_tier
+from src.inference.client import InferenceClient
 
-# Initialize AI Predictor
+# AI Predictor: the shared inference server, or an in-process model when INFERENCE_URL is empty
 @st.cache_resource
 def get_predictor():
+    if INFERENCE_URL:
+        return InferenceClient(INFERENCE_URL)
+    from src.inference.predictor import ModelPredictor
     return ModelPredictor()
 
 predictor = get_predictor()
@@ -27,8 +30,6 @@ st.title("NeuroSift: DICOM Viewer")
 
 # Connect to DB
 store = MetadataStore()
-Session = sessionmaker(bind=store.engine)
-session = Session()
 
 # Load test patients
 try:
@@ -58,28 +59,42 @@ with tab_gallery:
         
         # Filter images (Anatomical only)
         target_mods = ["T1", "T2", "FLAIR"]
-        query = session.query(ImageMetadata).filter(
-            ImageMetadata.pmc_id == selected_patient,
-            ImageMetadata.modality.in_(target_mods)
-        )
-        images = query.all()
+        images = store.get_slices(patient_ids=selected_patient, modalities=target_mods)
         
         st.sidebar.metric("Slices for Patient", len(images))
         
         # Analyze All Button
         if st.sidebar.button("Analyze All Images"):
             progress_bar = st.sidebar.progress(0)
-            for idx, img in enumerate(images):
-                if os.path.exists(img.s3_key):
-                    res = predictor.predict(img.s3_key)
-                    if res:
+            available = [img for img in images if slice_exists(img.s3_key)]
+            chunk = 64
+            for start in range(0, len(available), chunk):
+                batch = available[start:start + chunk]
+                results = predictor.predict_batch([pick_tier(img.s3_key, img.tiers, INPUT_SIZE) for img in batch])
+                for img, res in zip(batch, results):
+                    if res and "error" not in res:
                         st.session_state.predictions[img.id] = res
-                progress_bar.progress((idx + 1) / len(images))
+                progress_bar.progress(min(start + chunk, len(available)) / max(len(available), 1))
             st.sidebar.success("Analysis Complete")
         
         if images:
              st.sidebar.markdown(f"**Metadata**:\n{images[0].caption}")
         
+        # Stored predictions only count if the model currently served made them;
+        # older ones are re-run (the prediction cache makes repeat views cheap)
+        fingerprint = predictor.fingerprint
+        stale = [
+            img for img in images
+            if img.predicted_label and img.predicted_model != fingerprint
+            and img.id not in st.session_state.predictions and slice_exists(img.s3_key)
+        ]
+        if stale and fingerprint:
+            with st.spinner(f"Updating {len(stale)} predictions from an older model..."):
+                results = predictor.predict_batch([pick_tier(img.s3_key, img.tiers, INPUT_SIZE) for img in stale])
+            for img, res in zip(stale, results):
+                if res and "error" not in res:
+                    st.session_state.predictions[img.id] = res
+        
         st.header(f"Patient: {selected_patient}")
         st.info("Displaying test set images only")
     
@@ -88,17 +103,20 @@ with tab_gallery:
         for idx, img in enumerate(images):
             col = cols[idx % 3]
             with col:
-                if os.path.exists(img.s3_key):
-                    st.image(img.s3_key, caption=f"Slice {idx+1}")
+                if slice_exists(img.s3_key):
+                    # Grid cells only need the thumbnail tier
+                    st.image(load_slice(pick_tier(img.s3_key, img.tiers, THUMBNAIL_SIZE)), caption=f"Slice {idx+1}")
                     
                     # Individual Button
                     btn_key = f"btn_{img.id}"
                     
-                    # Check if we have a prediction in session state
+                    # Check if we have a prediction in session state, else the precomputed one (current model only)
                     pred = st.session_state.predictions.get(img.id)
+                    if not pred and img.predicted_label and img.predicted_model == fingerprint:
+                        pred = {"label": img.predicted_label, "confidence": img.predicted_confidence}
                     
                     if not pred and st.button("Analyze", key=btn_key):
-                        pred = predictor.predict(img.s3_key)
+                        pred = predictor.predict(pick_tier(img.s3_key, img.tiers, INPUT_SIZE))
                         st.session_state.predictions[img.id] = pred
                         st.rerun() # Refresh to show result
                         
@@ -131,10 +149,8 @@ with tab_upload:
         with col2:
             st.markdown("### Diagnosis")
             if st.button("Analyze Upload"):
-                res = predictor.predict("temp_upload.png")
+                res = predictor.predict(uploaded_file.getvalue())
                 if res:
                      st.metric("Predicted Modality", res['label'])
                      st.progress(res['confidence'])
                      st.caption(f"Confidence: {res['confidence']*100:.1f}%")
-
-session.close()
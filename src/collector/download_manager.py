@@ -0,0 +1,268 @@
+import os
+import io
+import csv
+import json
+import time
+import shutil
+import hashlib
+import logging
+import zipfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from src.config import LOCAL_DATA_DIR, TCIA_API_URL, DOWNLOAD_WORKERS, SERIES_LISTING_TTL
+from src.collector.metadata_store import MetadataStore, DownloadedSeries
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class NBIAClient:
+    """
+    Minimal client for the NBIA v1 REST API (the endpoints tcia_utils wraps).
+    base_url can point at a local stand-in server for tests.
+    """
+
+    def __init__(self, base_url=None, timeout=300, pool_size=None):
+        self.base_url = (base_url or TCIA_API_URL).rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size or DOWNLOAD_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_series(self, collection, patient_id=None, modality=None):
+        params = {"Collection": collection}
+        if patient_id:
+            params["PatientID"] = patient_id
+        if modality:
+            params["Modality"] = modality
+        resp = self.session.get(f"{self.base_url}/getSeries", params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json() if resp.content else []
+
+    def download_series(self, series_uid, dest_file, with_md5=True):
+        """Stream the series zip into dest_file (an open binary file)."""
+        endpoint = "getImageWithMD5Hash" if with_md5 else "getImage"
+        with self.session.get(
+            f"{self.base_url}/{endpoint}",
+            params={"SeriesInstanceUID": series_uid},
+            stream=True,
+            timeout=self.timeout
+        ) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=1 << 20):
+                dest_file.write(chunk)
+
+
+def _md5(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_md5_manifest(zf):
+    """{filename: md5} from the md5hashes.csv NBIA adds to hashed downloads."""
+    names = [n for n in zf.namelist() if os.path.basename(n).lower() == "md5hashes.csv"]
+    if not names:
+        return None
+    hashes = {}
+    with zf.open(names[0]) as f:
+        for row in csv.reader(io.TextIOWrapper(f, encoding="utf-8")):
+            if len(row) >= 2 and row[1].strip() and row[1].strip().lower() not in ("md5", "md5hash"):
+                hashes[os.path.basename(row[0].strip())] = row[1].strip().lower()
+    return hashes
+
+
+class DownloadManager:
+    """
+    Parallel, resumable cohort downloader.
+    - The collection's series listing is fetched once and cached on disk.
+    - Series are downloaded on a bounded thread pool, each into a temp dir
+      under a sibling "partial" dir (outside raw_dir, so index walks never
+      see half-written files, but on the same filesystem) that is renamed
+      into raw_dir/<SeriesInstanceUID> only once complete.
+    - Completed series are recorded in the downloaded_series ledger and
+      skipped on the next run.
+    - With verify_md5, files are checked against the API's MD5 manifest.
+    """
+
+    def __init__(self, collection="UPENN-GBM", client=None, raw_dir=None, max_workers=None,
+                 verify_md5=True, retries=3, store=None):
+        self.collection = collection
+        self.client = client or NBIAClient()
+        self.raw_dir = raw_dir or os.path.join(LOCAL_DATA_DIR, "dicom")
+        self.cache_dir = os.path.join(os.path.dirname(self.raw_dir), "cache")
+        self.partial_dir = os.path.join(os.path.dirname(self.raw_dir), "partial")
+        self.max_workers = max_workers or DOWNLOAD_WORKERS
+        self.verify_md5 = verify_md5
+        self.retries = retries
+        self.store = store or MetadataStore()
+        os.makedirs(self.raw_dir, exist_ok=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def series_listing(self, refresh=False):
+        """All series of the collection, from the on-disk cache when fresh."""
+        path = os.path.join(self.cache_dir, f"{self.collection}_series.json")
+        if not refresh and os.path.exists(path) and time.time() - os.path.getmtime(path) < SERIES_LISTING_TTL:
+            with open(path, "r") as f:
+                return json.load(f)
+
+        logger.info(f"Fetching series listing for {self.collection}...")
+        listing = self.client.get_series(self.collection)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(listing, f)
+        os.replace(tmp_path, path)
+        return listing
+
+    def list_patients(self):
+        return sorted({s["PatientID"] for s in self.series_listing()})
+
+    def completed(self):
+        session = self.store.Session()
+        try:
+            return {r[0] for r in session.query(DownloadedSeries.series_uid).all()}
+        finally:
+            session.close()
+
+    def _fetch(self, series):
+        """Download, extract, verify and move one series into place."""
+        uid = series["SeriesInstanceUID"]
+        final_dir = os.path.join(self.raw_dir, uid)
+        work_dir = tempfile.mkdtemp(prefix=f"{uid}-", dir=self.partial_dir)
+        try:
+            zip_path = os.path.join(work_dir, "series.zip")
+            with open(zip_path, "wb") as f:
+                self.client.download_series(uid, f, with_md5=self.verify_md5)
+
+            extract_dir = os.path.join(work_dir, uid)
+            with zipfile.ZipFile(zip_path) as zf:
+                expected = _read_md5_manifest(zf) if self.verify_md5 else None
+                zf.extractall(extract_dir)
+            os.remove(zip_path)
+
+            files = []
+            for root, dirs, names in os.walk(extract_dir):
+                for name in names:
+                    if name.lower() == "md5hashes.csv":
+                        os.remove(os.path.join(root, name))
+                    else:
+                        files.append(os.path.join(root, name))
+
+            verified = 0
+            if expected:
+                for path in files:
+                    want = expected.get(os.path.basename(path))
+                    if want and _md5(path) != want:
+                        raise ChecksumError(f"MD5 mismatch for {os.path.basename(path)} in {uid}")
+                verified = 1
+
+            size = sum(os.path.getsize(p) for p in files)
+            if os.path.exists(final_dir):
+                shutil.rmtree(final_dir) # Leftover from a run that died before the ledger write
+            os.replace(extract_dir, final_dir)
+            return {
+                "series_uid": uid,
+                "patient_id": series.get("PatientID"),
+                "collection": self.collection,
+                "file_count": len(files),
+                "bytes": size,
+                "verified": verified,
+            }
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _fetch_with_retry(self, series):
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self._fetch(series)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                wait = 2 ** attempt
+                logger.warning(f"{series['SeriesInstanceUID']}: {e} (attempt {attempt}, retrying in {wait}s)")
+                time.sleep(wait)
+
+    def _record(self, row):
+        stmt = self.store.insert_ignore(DownloadedSeries)
+        with self.store.engine.begin() as conn:
+            conn.execute(stmt, [row])
+
+    def download_cohort(self, num_patients=None, patient_ids=None, modality="MR", on_series=None,
+                        max_in_flight=None):
+        """
+        Download all `modality` series of the chosen patients (explicit ids,
+        or the first num_patients). on_series(row) is called as each series
+        lands, e.g. to feed a downstream stage. At most max_in_flight series
+        (default 2 x workers) are queued or downloading at once, so a
+        blocking on_series throttles the downloads instead of letting them
+        fill the disk. Returns the ledger rows written by this run.
+        """
+        max_in_flight = max(max_in_flight or 2 * self.max_workers, self.max_workers)
+        listing = self.series_listing()
+        if patient_ids is None:
+            patient_ids = sorted({s["PatientID"] for s in listing})
+            if num_patients is not None:
+                patient_ids = patient_ids[:num_patients]
+        wanted = set(patient_ids)
+
+        done = self.completed()
+        todo = [
+            s for s in listing
+            if s["PatientID"] in wanted
+            and (modality is None or s.get("Modality") == modality)
+            and s["SeriesInstanceUID"] not in done
+        ]
+        # Patient order, so early patients become complete (and usable) first
+        todo.sort(key=lambda s: (s["PatientID"], s["SeriesInstanceUID"]))
+        logger.info(
+            f"{len(wanted)} patients: {len(todo)} series to download, "
+            f"{len(done)} already in ledger, {self.max_workers} workers"
+        )
+
+        written = []
+        failed = 0
+        since = time.time()
+        pending = iter(todo)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+            while True:
+                # Refill the window; the next series is only submitted as one completes
+                for series in pending:
+                    futures[pool.submit(self._fetch_with_retry, series)] = series
+                    if len(futures) >= max_in_flight:
+                        break
+                if not futures:
+                    break
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    series = futures.pop(future)
+                    try:
+                        row = future.result()
+                    except Exception as e:
+                        failed += 1
+                        logger.error(f"Failed {series['SeriesInstanceUID']}: {e}")
+                        continue
+                    self._record(row)
+                    written.append(row)
+                    if on_series:
+                        on_series(row) # May block on a full downstream queue
+                    logger.info(f"[{len(written)}/{len(todo)}] {row['series_uid']} ({row['file_count']} files)")
+
+        total_mb = sum(r["bytes"] for r in written) / 1e6
+        elapsed = max(time.time() - since, 1e-6)
+        logger.info(
+            f"Downloaded {len(written)} series ({total_mb:.1f} MB, {total_mb / elapsed:.1f} MB/s), "
+            f"{failed} failed; re-run to resume"
+        )
+        return written
@@ -1,10 +1,11 @@
 import os
 import logging
-from sqlalchemy import create_engine, Column, String, Integer, Text, DateTime
+from sqlalchemy import create_engine, Column, String, Integer, BigInteger, Float, Text, DateTime, Index, inspect, text, func, select, and_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
-from src.config import USE_LOCAL_STORAGE, DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, SQLITE_DB_PATH, MINIO_BUCKET_NAME
+from src.config import USE_LOCAL_STORAGE, DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, SQLITE_DB_PATH, MINIO_BUCKET_NAME, DB_BATCH_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +13,14 @@ Base = declarative_base()
 
 class ImageMetadata(Base):
     __tablename__ = 'image_metadata'
+    __table_args__ = (
+        # Natural key, also backs the existence check in save_image_metadata
+        Index('uq_image_metadata_pmc_graphic', 'pmc_id', 'graphic_id', unique=True),
+        # Hot filters: gallery/dataset (patient + modality), labeling and viewer (series order)
+        Index('ix_image_metadata_pmc_modality', 'pmc_id', 'modality'),
+        Index('ix_image_metadata_modality_pmc', 'modality', 'pmc_id'),
+        Index('ix_image_metadata_series_instance', 'series_uid', 'instance_number'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     pmc_id = Column(String(50))
     figure_id = Column(String(50))
@@ -20,9 +29,72 @@ class ImageMetadata(Base):
     caption = Column(Text)
     modality = Column(String(50), nullable=True)
     pathology = Column(String(100), nullable=True)
+    series_uid = Column(String(128), nullable=True) # Full SeriesInstanceUID
+    instance_number = Column(Integer, nullable=True)
+    # Pre-resized copies available for this slice, e.g. "224,128" (see tensor_store.tier_key)
+    tiers = Column(String(50), nullable=True)
+    # Written by the offline scoring job (src/inference/bulk_score.py)
+    predicted_label = Column(String(50), nullable=True)
+    predicted_confidence = Column(Float, nullable=True)
+    predicted_model = Column(String(64), nullable=True) # Model fingerprint
     is_valid = Column(Integer, default=1) # 1=True, 0=False (SQLite doesn't have native Boolean)
     collected_at = Column(DateTime, default=datetime.utcnow)
 
+class SourceManifest(Base):
+    # One row per converted DICOM, used to skip unchanged files on re-runs
+    __tablename__ = 'source_manifest'
+    path = Column(String(500), primary_key=True) # Relative to the raw dicom dir
+    size = Column(BigInteger)
+    mtime = Column(Float)
+    content_hash = Column(String(64))
+    output_key = Column(String(200))
+    processed_at = Column(DateTime, default=datetime.utcnow)
+
+class DicomInstance(Base):
+    # Header-only index of the raw DICOM tree, shared by all pipeline stages
+    __tablename__ = 'dicom_instance'
+    __table_args__ = (
+        Index('ix_dicom_instance_patient_series', 'patient_id', 'series_uid', 'instance_number'),
+        Index('ix_dicom_instance_series', 'series_uid'),
+    )
+    path = Column(String(500), primary_key=True) # Relative to the raw dicom dir
+    patient_id = Column(String(64))
+    series_uid = Column(String(128))
+    series_description = Column(String(200), nullable=True)
+    modality = Column(String(16), nullable=True)
+    instance_number = Column(Integer, nullable=True)
+    slice_position = Column(Float, nullable=True) # Z of ImagePositionPatient, else SliceLocation
+    file_size = Column(BigInteger)
+    mtime = Column(Float)
+
+class PredictionCacheEntry(Base):
+    # Model output per (slice content, checkpoint) so predictions survive sessions
+    __tablename__ = 'prediction_cache'
+    content_hash = Column(String(64), primary_key=True)
+    model_fingerprint = Column(String(64), primary_key=True)
+    label = Column(String(50))
+    confidence = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ScoringCheckpoint(Base):
+    # Last ImageMetadata.id scored per (model, shard), for resuming bulk scoring
+    __tablename__ = 'scoring_checkpoint'
+    job_key = Column(String(100), primary_key=True)
+    last_id = Column(Integer, default=0)
+    failed_ids = Column(Text, nullable=True) # Comma-separated ids at or below last_id that failed, retried on resume
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DownloadedSeries(Base):
+    # Ledger of completed TCIA series downloads, so interrupted runs resume
+    __tablename__ = 'downloaded_series'
+    series_uid = Column(String(128), primary_key=True)
+    patient_id = Column(String(64))
+    collection = Column(String(100))
+    file_count = Column(Integer)
+    bytes = Column(BigInteger)
+    verified = Column(Integer, default=0) # 1 = MD5s checked against the API
+    downloaded_at = Column(DateTime, default=datetime.utcnow)
+
 class MetadataStore:
     def __init__(self):
         if USE_LOCAL_STORAGE:
@@ -33,7 +105,102 @@ class MetadataStore:
         
         self.engine = create_engine(db_url)
         Base.metadata.create_all(self.engine)
+        self._ensure_columns()
+        self._ensure_indexes()
         self.Session = sessionmaker(bind=self.engine)
+
+    def _ensure_columns(self):
+        # Light migration for DBs created before a column was added
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=self.engine.dialect)
+                with self.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+    def _ensure_indexes(self):
+        # create_all skips tables that already exist, so indexes added
+        # after a DB was created have to be created explicitly
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.unique:
+                    # Insert-or-ignore relies on this index, so it must not be skipped
+                    self._drop_duplicates(index)
+                    index.create(self.engine, checkfirst=True)
+                    logger.info(f"Created unique index {index.name}")
+                    continue
+                try:
+                    index.create(self.engine, checkfirst=True)
+                except Exception as e:
+                    logger.warning(f"Could not create index {index.name}: {e}")
+
+    def _drop_duplicates(self, index):
+        """Delete rows repeating a unique index's key (older DBs allowed them), keeping the first."""
+        table = index.table
+        pk = list(table.primary_key.columns)[0]
+        columns = list(index.columns)
+        not_null = and_(*[c.isnot(None) for c in columns]) # NULL keys never collide
+        keep = select(func.min(pk)).where(not_null).group_by(*columns)
+        with self.engine.begin() as conn:
+            result = conn.execute(table.delete().where(not_null, pk.not_in(keep)))
+        if result.rowcount:
+            logger.warning(f"Removed {result.rowcount} duplicate {table.name} rows before creating {index.name}")
+
+    def insert_ignore(self, model):
+        """INSERT ... ON CONFLICT DO NOTHING for the current dialect."""
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(model).on_conflict_do_nothing()
+        if self.engine.dialect.name == "sqlite":
+            return sqlite.insert(model).on_conflict_do_nothing()
+        raise NotImplementedError(f"Bulk upsert not supported on {self.engine.dialect.name}")
+
+    def upsert(self, model, index_elements, update_columns):
+        """INSERT ... ON CONFLICT (index_elements) DO UPDATE of update_columns for the current dialect."""
+        if self.engine.dialect.name == "postgresql":
+            stmt = postgresql.insert(model)
+        elif self.engine.dialect.name == "sqlite":
+            stmt = sqlite.insert(model)
+        else:
+            raise NotImplementedError(f"Bulk upsert not supported on {self.engine.dialect.name}")
+        return stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+
+    def save_image_metadata_bulk(self, rows, batch_size=None):
+        """
+        Insert ImageMetadata rows (dicts keyed by column name), skipping
+        any (pmc_id, graphic_id) already present. One transaction per batch.
+        Returns the number of rows actually inserted.
+        """
+        batch_size = batch_size or DB_BATCH_SIZE
+        stmt = self.insert_ignore(ImageMetadata)
+        inserted = 0
+        batch = []
+
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                inserted += self._execute_batch(stmt, batch)
+                batch = []
+        if batch:
+            inserted += self._execute_batch(stmt, batch)
+
+        logger.info(f"Bulk inserted {inserted} image records")
+        return inserted
+
+    def _execute_batch(self, stmt, batch):
+        with self.engine.begin() as conn:
+            result = conn.execute(stmt, batch)
+        return max(result.rowcount, 0)
     
     def save_image_metadata(self, meta_dict):
         session = self.Session()
@@ -66,3 +233,56 @@ class MetadataStore:
             session.rollback()
         finally:
             session.close()
+
+    # Query API. Each call opens and closes its own session; returned ORM
+    # objects are detached but keep their loaded attributes.
+
+    def list_patients(self, modalities=None):
+        """Distinct patient ids, optionally only those with slices of the given modalities."""
+        session = self.Session()
+        try:
+            query = session.query(ImageMetadata.pmc_id).distinct()
+            if modalities:
+                query = query.filter(ImageMetadata.modality.in_(modalities))
+            return [p[0] for p in query.order_by(ImageMetadata.pmc_id).all()]
+        finally:
+            session.close()
+
+    def get_slices(self, patient_ids=None, modalities=None, series_uid=None, ordered=True):
+        """
+        Slices filtered by patient(s), modality and/or series.
+        patient_ids may be a single id or a list. ordered=True sorts by series
+        then instance number, which is what viewers want; datasets can skip it.
+        """
+        session = self.Session()
+        try:
+            query = session.query(ImageMetadata)
+            if isinstance(patient_ids, str):
+                query = query.filter(ImageMetadata.pmc_id == patient_ids)
+            elif patient_ids is not None:
+                query = query.filter(ImageMetadata.pmc_id.in_(patient_ids))
+            if modalities:
+                query = query.filter(ImageMetadata.modality.in_(modalities))
+            if series_uid:
+                query = query.filter(ImageMetadata.series_uid == series_uid)
+            if ordered:
+                query = query.order_by(ImageMetadata.series_uid, ImageMetadata.instance_number, ImageMetadata.id)
+            return query.all()
+        finally:
+            session.close()
+
+    def list_series(self, patient_id):
+        """[(series_uid, modality, slice_count)] for one patient."""
+        session = self.Session()
+        try:
+            return session.query(
+                ImageMetadata.series_uid,
+                ImageMetadata.modality,
+                func.count(ImageMetadata.id)
+            ).filter(
+                ImageMetadata.pmc_id == patient_id
+            ).group_by(
+                ImageMetadata.series_uid, ImageMetadata.modality
+            ).order_by(ImageMetadata.series_uid).all()
+        finally:
+            session.close()
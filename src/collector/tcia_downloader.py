@@ -3,6 +3,7 @@ import logging
 import pandas as pd
 from tcia_utils import nbia
 from src.config import LOCAL_DATA_DIR
+from src.collector.download_manager import DownloadManager
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,8 +32,14 @@ class TCIADownloader:
         
         return []
 
-    def download_cohort(self, num_patients=3):
+    def download_cohort(self, num_patients=3, parallel=True):
         """Download DICOMs for a subset of patients."""
+        if parallel:
+            # Cached listing, bounded concurrency, MD5 checks and a resume ledger
+            manager = DownloadManager(collection=self.collection, raw_dir=self.raw_dir)
+            manager.download_cohort(num_patients=num_patients, modality="MR")
+            return
+
         patients = self.list_patients()
         
         # tcia_utils returns a list of dictionaries usually, or json
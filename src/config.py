@@ -12,9 +12,28 @@ MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin") # Default docker values
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME", "neuro-images")
+MINIO_SECURE = os.getenv("MINIO_SECURE", "False").lower() == "true"
+
+# Where processed slices are written: "local" files or "s3" (MinIO / S3).
+# Defaults to the local-mode switch, but can be set on its own (e.g. SQLite + MinIO)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local" if USE_LOCAL_STORAGE else "s3")
+STORAGE_PREFIX = os.getenv("STORAGE_PREFIX", "processed")
+# Pooled keep-alive connections per process, and threads for concurrent uploads / reads
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", "32"))
+STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "16"))
+# Read-through local copy of remote slices, evicted least recently used first
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", os.path.join(os.getcwd(), "data", "cache", "storage"))
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+# TCIA / NBIA Config
+TCIA_API_URL = os.getenv("TCIA_API_URL", "https://services.cancerimagingarchive.net/nbia-api/services/v1")
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+# Seconds before the cached collection series listing is fetched again
+SERIES_LISTING_TTL = int(os.getenv("SERIES_LISTING_TTL", str(24 * 3600)))
 
 # Local Storage Config
 LOCAL_DATA_DIR = os.path.join(os.getcwd(), "data", "raw")
+PROCESSED_DIR = os.path.join(LOCAL_DATA_DIR, "processed")
 
 # Database Config
 # If using Docker/Postgres
@@ -27,6 +46,68 @@ DB_NAME = os.getenv("POSTGRES_DB", "neurosift")
 # If using SQLite
 SQLITE_DB_PATH = "neurosift.db"
 
+# Processing Config
+# Number of worker processes for DICOM conversion (1 = run in-process)
+PROCESSING_WORKERS = int(os.getenv("PROCESSING_WORKERS", os.cpu_count() or 1))
+# Files handed to a worker at a time
+PROCESSING_CHUNK_SIZE = int(os.getenv("PROCESSING_CHUNK_SIZE", "16"))
+# Rows per DB commit during ingestion
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "500"))
+# Intensity normalization: "slice" (per-slice percentiles) or "volume" (one window per series)
+NORMALIZATION_MODE = os.getenv("NORMALIZATION_MODE", "slice")
+# Processed slice format: "png" (one file per slice) or "npy" (memory-mapped volume per series)
+OUTPUT_BACKEND = os.getenv("OUTPUT_BACKEND", "png")
+# Square pre-resized copies written next to each slice (model input, UI thumbnail)
+SLICE_TIERS = [int(x) for x in os.getenv("SLICE_TIERS", "224,128").split(",") if x.strip()]
+INPUT_SIZE = 224 # Model input resolution
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "128"))
+# Items buffered between stages of the streaming ingest pipeline
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+
+# Training Config
+# DataLoader worker processes (0 = load in the training process)
+TRAIN_NUM_WORKERS = int(os.getenv("TRAIN_NUM_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Batches each worker keeps ready ahead of the training loop
+TRAIN_PREFETCH_FACTOR = int(os.getenv("TRAIN_PREFETCH_FACTOR", "4"))
+TRAIN_PERSISTENT_WORKERS = os.getenv("TRAIN_PERSISTENT_WORKERS", "True").lower() == "true"
+# Page-locked host batches for faster copies (only used with CUDA)
+TRAIN_PIN_MEMORY = os.getenv("TRAIN_PIN_MEMORY", "True").lower() == "true"
+# Decode every slice once into shared memory and serve epochs from RAM
+TRAIN_SLICE_CACHE = os.getenv("TRAIN_SLICE_CACHE", "True").lower() == "true"
+# DistributedDataParallel process group backend when launched with torchrun
+TRAIN_DIST_BACKEND = os.getenv("TRAIN_DIST_BACKEND", "gloo")
+# torch intra-op threads per training process (0 = cores / local ranks)
+TRAIN_THREADS = int(os.getenv("TRAIN_THREADS", "0"))
+# Stop after this many epochs without a better val accuracy (0 = never)
+TRAIN_PATIENCE = int(os.getenv("TRAIN_PATIENCE", "5"))
+# Write a resumable checkpoint every N epochs
+TRAIN_CHECKPOINT_EVERY = int(os.getenv("TRAIN_CHECKPOINT_EVERY", "1"))
+# One directory per training run: checkpoint.pt, model.pth (best), meta.json
+MODEL_VERSIONS_DIR = os.getenv("MODEL_VERSIONS_DIR", os.path.join("models", "versions"))
+# Model served by default: a checkpoint path, a version tag or "latest"
+MODEL_NAME = os.getenv("MODEL_NAME", os.path.join("models", "neurosift_resnet18.pth"))
+
+# Inference Config
+# eager | torchscript | compile | int8_dynamic | int8_static
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+INFERENCE_CHANNELS_LAST = os.getenv("INFERENCE_CHANNELS_LAST", "False").lower() == "true"
+# Inference server (dynamic batching). Empty INFERENCE_URL = predict in-process
+INFERENCE_URL = os.getenv("INFERENCE_URL", "")
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "32"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+# Prediction cache (DB table + in-memory LRU in front of it)
+PREDICTION_CACHE = os.getenv("PREDICTION_CACHE", "True").lower() == "true"
+PREDICTION_CACHE_LRU_SIZE = int(os.getenv("PREDICTION_CACHE_LRU_SIZE", "50000"))
+
+# Instrumentation (src/instrumentation.py): hot-path timers and counters
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "False").lower() == "true"
+INSTRUMENTATION_DIR = os.getenv("INSTRUMENTATION_DIR", os.path.join(os.getcwd(), "data", "metrics"))
+# Also keep every timed call as a span for a Chrome / Perfetto trace.json
+INSTRUMENTATION_TRACE = os.getenv("INSTRUMENTATION_TRACE", "False").lower() == "true"
+# "" (off) | "cprofile" (.prof per process) | "sample" (folded stacks, py-spy raw format)
+INSTRUMENTATION_PROFILE = os.getenv("INSTRUMENTATION_PROFILE", "")
+INSTRUMENTATION_SAMPLE_MS = float(os.getenv("INSTRUMENTATION_SAMPLE_MS", "5"))
+
 # PubMed Config
 # Always provide an email to NCBI so they can contact you if you flood them
 EMAIL = os.getenv("NCBI_EMAIL", "your.email@example.com") 
@@ -0,0 +1,88 @@
+import json
+import random
+import logging
+import torch
+import torch.nn as nn
+from src.collector.metadata_store import MetadataStore
+from src.processing.tensor_store import pick_tier
+from src.config import INPUT_SIZE
+
+logger = logging.getLogger(__name__)
+
+# CPU inference backends selectable on ModelPredictor
+BACKENDS = ["eager", "torchscript", "compile", "int8_dynamic", "int8_static"]
+
+
+def calibration_items(classes, n=256, split="train", seed=42):
+    """
+    Sample processed slices for static quantization calibration.
+    Drawn from the train split so the test split stays untouched for the
+    parity check.
+    """
+    try:
+        with open("data/splits.json", "r") as f:
+            patients = json.load(f).get(split, [])
+    except FileNotFoundError:
+        patients = None
+
+    records = MetadataStore().get_slices(patient_ids=patients, modalities=classes, ordered=False)
+    keys = [pick_tier(r.s3_key, r.tiers, INPUT_SIZE) for r in records]
+    random.Random(seed).shuffle(keys)
+    return keys[:n]
+
+
+def _quantize_static(model, example, calibration_batches):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    torch.backends.quantized.engine = engine
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (example,))
+
+    seen = 0
+    with torch.inference_mode():
+        for batch in calibration_batches:
+            prepared(batch)
+            seen += batch.shape[0]
+    if seen == 0:
+        logger.warning("No calibration data, int8 ranges will be poor")
+    logger.info(f"Calibrated int8 model on {seen} slices ({engine})")
+    return convert_fx(prepared)
+
+
+def optimize_model(model, backend="eager", in_channels=1, channels_last=False, calibration_batches=None):
+    """
+    Wrap an eval-mode fp32 model for CPU inference.
+    Falls back to the eager model (with an error logged) if the backend
+    cannot be built on this machine; compiled backends are warmed up on an
+    example batch first, so their errors surface here.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+
+    model.eval()
+    example = torch.randn(1, in_channels, 224, 224)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        example = example.contiguous(memory_format=torch.channels_last)
+
+    try:
+        if backend == "torchscript":
+            with torch.inference_mode():
+                traced = torch.jit.trace(model, example)
+            return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+        if backend == "compile":
+            compiled = torch.compile(model)
+            # Compilation is lazy: run it now so a missing toolchain falls back here
+            with torch.inference_mode():
+                compiled(example)
+            return compiled
+        if backend == "int8_dynamic":
+            # Only the Linear head is dynamically quantizable in ResNet
+            return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        if backend == "int8_static":
+            return _quantize_static(model, example, calibration_batches or [])
+    except Exception as e:
+        logger.error(f"Failed to build {backend} backend, using eager: {e}")
+
+    return model
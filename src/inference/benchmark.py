@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+import numpy as np
+import cv2
+import torch
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+from src.inference.backends import BACKENDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metrics compared against a baseline, and whether higher is better
+TRACKED = {
+    "latency_ms_p50": False,
+    "latency_ms_p95": False,
+    "latency_ms_p99": False,
+    "throughput": True,
+    "peak_rss_mb": False,
+}
+
+
+def make_fixtures(root, slices=64, size=256, seed=0):
+    """
+    Deterministic synthetic MR slices: an ellipse phantom with noise,
+    written as DICOM and as windowed PNGs (what the predictor reads in
+    production). Returns (dicom_paths, png_paths).
+    """
+    from src.processing.dicom_processor import DicomProcessor
+
+    rng = np.random.default_rng(seed)
+    dicom_dir = os.path.join(root, "dicom")
+    png_dir = os.path.join(root, "png")
+    os.makedirs(dicom_dir, exist_ok=True)
+    os.makedirs(png_dir, exist_ok=True)
+
+    yy, xx = np.mgrid[:size, :size]
+    series_uid = generate_uid()
+    dicom_paths, png_paths = [], []
+    for i in range(slices):
+        r = 0.3 + 0.1 * np.sin(i / 5)
+        phantom = (((xx / size - 0.5) / r) ** 2 + ((yy / size - 0.5) / (r * 1.2)) ** 2) < 1
+        pixels = (phantom * 800 + rng.normal(200, 50, (size, size))).clip(0, 4095).astype(np.uint16)
+
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = MRImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.PatientID = "BENCH"
+        ds.Modality = "MR"
+        ds.SeriesInstanceUID = series_uid
+        ds.SeriesDescription = "T1_BENCH"
+        ds.InstanceNumber = i + 1
+        ds.Rows, ds.Columns = size, size
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 0
+        ds.PixelData = pixels.tobytes()
+        dicom_path = os.path.join(dicom_dir, f"{i:04d}.dcm")
+        ds.save_as(dicom_path, enforce_file_format=True)
+        dicom_paths.append(dicom_path)
+
+        img, _ = DicomProcessor.read_dicom(dicom_path)
+        png_path = os.path.join(png_dir, f"{i:04d}.png")
+        cv2.imwrite(png_path, DicomProcessor.apply_window(img))
+        png_paths.append(png_path)
+    return dicom_paths, png_paths
+
+
+def make_checkpoint(path, seed=0):
+    """Randomly initialised 1-channel ResNet18; speed does not depend on the weights."""
+    from src.training.model import build_model
+    torch.manual_seed(seed)
+    torch.save(build_model(3, in_channels=1, pretrained=False).state_dict(), path)
+    return path
+
+
+def percentiles(samples_ms):
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {"latency_ms_p50": float(p50), "latency_ms_p95": float(p95), "latency_ms_p99": float(p99)}
+
+
+def timed(func, items):
+    """Mean milliseconds per item of func over items."""
+    since = time.perf_counter()
+    for item in items:
+        func(item)
+    return 1000 * (time.perf_counter() - since) / max(len(items), 1)
+
+
+def bench_preprocessing(dicom_paths, png_paths):
+    """Per-slice cost of each ingest and inference preprocessing step."""
+    from src.processing.dicom_processor import DicomProcessor
+    from src.inference.predictor import ModelPredictor
+
+    images = [DicomProcessor.read_dicom(p)[0] for p in dicom_paths]
+    windowed = [DicomProcessor.apply_window(img) for img in images]
+    predictor = ModelPredictor("", cache=False) # Transform only, no model needed
+    return {
+        "dicom_read_ms": timed(DicomProcessor.read_dicom, dicom_paths),
+        "window_ms": timed(DicomProcessor.apply_window, images),
+        "png_encode_ms": timed(lambda img: cv2.imencode(".png", img), windowed),
+        "png_decode_ms": timed(lambda p: cv2.imread(p, cv2.IMREAD_GRAYSCALE), png_paths),
+        "predict_preprocess_ms": timed(predictor._preprocess, png_paths),
+    }
+
+
+def bench_backend(job):
+    """
+    One backend in a fresh process, so peak RSS is its own. Returns
+    latency percentiles (single slice, end to end), batched throughput
+    and peak RSS.
+    """
+    backend, model_path, png_paths, batch_size, latency_samples, threads = job
+    torch.set_num_threads(threads)
+    from src.inference.predictor import ModelPredictor
+
+    predictor = ModelPredictor(model_path, backend=backend, cache=False, calibration=png_paths)
+    if predictor.model is None:
+        return {"backend": backend, "error": "model failed to load"}
+
+    # Warm-up: first calls pay for compilation, allocator growth and page faults
+    predictor.predict_batch(png_paths[:batch_size], batch_size=batch_size)
+    for path in png_paths[:5]:
+        predictor.predict(path)
+
+    latencies = []
+    for i in range(latency_samples):
+        path = png_paths[i % len(png_paths)]
+        start = time.perf_counter()
+        predictor.predict(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    since = time.perf_counter()
+    predictor.predict_batch(png_paths, batch_size=batch_size)
+    elapsed = time.perf_counter() - since
+
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+    result = {"backend": backend, "throughput": len(png_paths) / elapsed, "peak_rss_mb": rss_mb}
+    result.update(percentiles(latencies))
+    return result
+
+
+def run_benchmarks(backends=None, slices=64, size=256, batch_size=32, latency_samples=100,
+                   threads=None, seed=0, workdir=None):
+    backends = backends or BACKENDS
+    threads = threads or torch.get_num_threads()
+    root = workdir or tempfile.mkdtemp(prefix="neurosift-bench-")
+    try:
+        dicom_paths, png_paths = make_fixtures(root, slices=slices, size=size, seed=seed)
+        model_path = make_checkpoint(os.path.join(root, "model.pth"), seed=seed)
+
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "cpu_count": os.cpu_count(),
+                "threads": threads,
+                "machine": platform.machine(),
+            },
+            "config": {"slices": slices, "size": size, "batch_size": batch_size,
+                       "latency_samples": latency_samples, "seed": seed},
+            "preprocessing": bench_preprocessing(dicom_paths, png_paths),
+            "backends": {},
+        }
+
+        ctx = multiprocessing.get_context("spawn")
+        for backend in backends:
+            logger.info(f"Benchmarking {backend}...")
+            with ctx.Pool(processes=1) as pool:
+                result = pool.apply(bench_backend, ((backend, model_path, png_paths, batch_size, latency_samples, threads),))
+            report["backends"][backend] = result
+        return report
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def regressions(report, baseline, tolerance=0.10):
+    """Metrics that got worse than the baseline by more than tolerance (relative)."""
+    found = []
+    for backend, result in report["backends"].items():
+        base = baseline.get("backends", {}).get(backend)
+        if not base or "error" in result or "error" in base:
+            continue
+        for metric, higher_is_better in TRACKED.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                found.append(f"{backend} {metric}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return found
+
+
+def print_report(report):
+    print("\nPreprocessing (ms/slice)")
+    for name, value in report["preprocessing"].items():
+        print(f"  {name:<24}{value:>8.3f}")
+
+    print(f"\n{'backend':<14}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'slices/s':>10}{'RSS MB':>9}")
+    for backend, r in report["backends"].items():
+        if "error" in r:
+            print(f"{backend:<14}  {r['error']}")
+            continue
+        print(
+            f"{backend:<14}{r['latency_ms_p50']:>9.2f}{r['latency_ms_p95']:>9.2f}{r['latency_ms_p99']:>9.2f}"
+            f"{r['throughput']:>10.1f}{r['peak_rss_mb']:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency / throughput / memory benchmark on synthetic fixtures")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=None)
+    parser.add_argument("--slices", type=int, default=64)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--latency-samples", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (pin for comparable runs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.backends, args.slices, args.size, args.batch_size,
+                            args.latency_samples, args.threads, args.seed)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        found = regressions(report, baseline, args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        raise SystemExit(1 if found else 0)
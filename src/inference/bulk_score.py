@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import argparse
+from multiprocessing import Process
+import torch
+from sqlalchemy import or_
+from src.collector.metadata_store import MetadataStore, ImageMetadata, ScoringCheckpoint
+from src.inference.predictor import ModelPredictor
+from src.processing.tensor_store import pick_tier
+from src.config import INPUT_SIZE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def score_shard(shard, shards, model_path, chunk_size=2048, batch_size=64, threads=None):
+    """
+    Score every ImageMetadata row with id % shards == shard.
+    Rows are streamed by keyset pagination (id > last_id), scored with
+    predict_batch and written back in one transaction per chunk together
+    with the shard checkpoint, so a killed job resumes at the last chunk.
+    Ids of rows that failed to score are kept in the checkpoint and retried
+    first when the job is run again. Rows already scored by this model are
+    skipped, even across reshards.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+
+    store = MetadataStore()
+    predictor = ModelPredictor(model_path, cache=False) # Results go to the catalog itself
+    if predictor.model is None:
+        return
+    fingerprint = predictor.fingerprint
+    job_key = f"{fingerprint}:{shard}/{shards}"
+
+    session = store.Session()
+    try:
+        checkpoint = session.get(ScoringCheckpoint, job_key)
+        if checkpoint is None:
+            checkpoint = ScoringCheckpoint(job_key=job_key, last_id=0)
+            session.add(checkpoint)
+            session.commit()
+        last_id = checkpoint.last_id
+        failed = {int(i) for i in (checkpoint.failed_ids or "").split(",") if i}
+        if last_id:
+            logger.info(f"[shard {shard}] Resuming after id {last_id}, retrying {len(failed)} failed rows")
+
+        def unscored():
+            return session.query(ImageMetadata.id, ImageMetadata.s3_key, ImageMetadata.tiers).filter(
+                ImageMetadata.id % shards == shard,
+                ImageMetadata.is_valid == 1,
+                or_(ImageMetadata.predicted_model.is_(None), ImageMetadata.predicted_model != fingerprint)
+            )
+
+        def score(rows):
+            """Write back one chunk's predictions; returns (scored, ids that failed)."""
+            keys = [pick_tier(r.s3_key, r.tiers, INPUT_SIZE) for r in rows]
+            results = predictor.predict_batch(keys, batch_size=batch_size)
+            updates = []
+            errors = set()
+            for row, res in zip(rows, results):
+                if res and "error" not in res:
+                    updates.append({
+                        "id": row.id,
+                        "predicted_label": res["label"],
+                        "predicted_confidence": res["confidence"],
+                        "predicted_model": fingerprint,
+                    })
+                else:
+                    errors.add(row.id)
+            session.bulk_update_mappings(ImageMetadata, updates)
+            return len(updates), errors
+
+        scored = 0
+        since = time.time()
+
+        # Earlier failures first; rows scored or deleted since simply drop out
+        retry = sorted(failed)
+        for i in range(0, len(retry), chunk_size):
+            chunk = retry[i:i + chunk_size]
+            rows = unscored().filter(ImageMetadata.id.in_(chunk)).order_by(ImageMetadata.id).all()
+            n, errors = score(rows) if rows else (0, set())
+            failed = (failed - set(chunk)) | errors
+            checkpoint.failed_ids = ",".join(map(str, sorted(failed))) or None
+            session.commit()
+            scored += n
+
+        while True:
+            rows = unscored().filter(ImageMetadata.id > last_id).order_by(ImageMetadata.id).limit(chunk_size).all()
+            if not rows:
+                break
+
+            n, errors = score(rows)
+            failed |= errors
+            last_id = rows[-1].id
+            checkpoint.last_id = last_id
+            checkpoint.failed_ids = ",".join(map(str, sorted(failed))) or None
+            session.commit()
+
+            scored += n
+            logger.info(f"[shard {shard}] {scored} scored ({scored / max(time.time() - since, 1e-6):.1f}/s), up to id {last_id}")
+    finally:
+        session.close()
+
+    logger.info(f"[shard {shard}] Done: {scored} scored, {len(failed)} failed")
+    if failed:
+        logger.warning(f"[shard {shard}] Failed ids {sorted(failed)[:20]}{'...' if len(failed) > 20 else ''}; re-run to retry them")
+
+
+def bulk_score(model_path="models/neurosift_resnet18.pth", shards=None, chunk_size=2048, batch_size=64, restart=False):
+    """Run score_shard in `shards` processes, splitting CPU threads between them."""
+    shards = shards or max(1, (os.cpu_count() or 1) // 4)
+    threads = max(1, (os.cpu_count() or 1) // shards)
+
+    if restart:
+        store = MetadataStore()
+        session = store.Session()
+        session.query(ScoringCheckpoint).delete()
+        session.query(ImageMetadata).update({"predicted_model": None}, synchronize_session=False)
+        session.commit()
+        session.close()
+
+    if shards == 1:
+        score_shard(0, 1, model_path, chunk_size, batch_size, threads)
+        return
+
+    procs = [
+        Process(target=score_shard, args=(i, shards, model_path, chunk_size, batch_size, threads))
+        for i in range(shards)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    failed = [i for i, p in enumerate(procs) if p.exitcode != 0]
+    if failed:
+        logger.error(f"Shards {failed} exited with errors; re-run to resume them")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute predictions for the whole catalog")
+    parser.add_argument("--model", default="models/neurosift_resnet18.pth")
+    parser.add_argument("--shards", type=int, default=None, help="Worker processes")
+    parser.add_argument("--chunk-size", type=int, default=2048, help="Rows per DB read/commit")
+    parser.add_argument("--batch-size", type=int, default=64, help="Slices per forward pass")
+    parser.add_argument("--restart", action="store_true", help="Forget progress and rescore everything")
+    args = parser.parse_args()
+
+    bulk_score(args.model, args.shards, args.chunk_size, args.batch_size, args.restart)
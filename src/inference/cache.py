@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.config import PREDICTION_CACHE_LRU_SIZE, DB_BATCH_SIZE
+from src.collector.metadata_store import MetadataStore, PredictionCacheEntry
+from src.processing.tensor_store import is_tensor_key, load_slice
+from src.processing.storage import local_path
+from src.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(item):
+    """SHA1 of a slice's content: file bytes, tensor-store view, array or raw bytes."""
+    if isinstance(item, (bytes, bytearray)):
+        data = bytes(item)
+    elif isinstance(item, np.ndarray):
+        data = np.ascontiguousarray(item).tobytes()
+    elif is_tensor_key(item):
+        data = np.ascontiguousarray(load_slice(item)).tobytes()
+    else:
+        with open(local_path(item), "rb") as f:
+            data = f.read()
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_fingerprint(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PredictionCache:
+    """
+    Predictions keyed by (slice content hash, model fingerprint). An LRU
+    holds hot entries in memory; the prediction_cache table shares them
+    across sessions, users and processes. A new checkpoint has a new
+    fingerprint, so stale entries are simply never hit.
+    """
+
+    def __init__(self, fingerprint, store=None, max_items=None):
+        self.fingerprint = fingerprint
+        self.store = store or MetadataStore()
+        self.max_items = max_items or PREDICTION_CACHE_LRU_SIZE
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, result):
+        self._lru[key] = result
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys):
+        """{content_hash: result} for the keys that are cached."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+
+        missing = list({k for k in keys if k not in found})
+        if missing:
+            session = self.store.Session()
+            try:
+                for i in range(0, len(missing), DB_BATCH_SIZE):
+                    rows = session.query(PredictionCacheEntry).filter(
+                        PredictionCacheEntry.model_fingerprint == self.fingerprint,
+                        PredictionCacheEntry.content_hash.in_(missing[i:i + DB_BATCH_SIZE])
+                    ).all()
+                    for row in rows:
+                        found[row.content_hash] = {"label": row.label, "confidence": row.confidence}
+            except Exception as e:
+                logger.error(f"Prediction cache lookup failed: {e}")
+            finally:
+                session.close()
+
+            with self._lock:
+                for key in missing:
+                    if key in found:
+                        self._remember(key, found[key])
+
+        hits = sum(1 for k in keys if k in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        count("prediction_cache_hits", hits)
+        count("prediction_cache_misses", len(keys) - hits)
+        return found
+
+    def put_many(self, entries):
+        """entries: {content_hash: {"label", "confidence"}}"""
+        if not entries:
+            return
+        with self._lock:
+            for key, result in entries.items():
+                self._remember(key, result)
+
+        rows = [
+            {
+                "content_hash": key,
+                "model_fingerprint": self.fingerprint,
+                "label": result["label"],
+                "confidence": result["confidence"],
+            }
+            for key, result in entries.items()
+        ]
+        try:
+            stmt = self.store.insert_ignore(PredictionCacheEntry)
+            with self.store.engine.begin() as conn:
+                conn.execute(stmt, rows)
+        except Exception as e:
+            logger.error(f"Prediction cache write failed: {e}")
+
+    def purge_stale(self):
+        """Delete entries written by other checkpoints."""
+        session = self.store.Session()
+        try:
+            deleted = session.query(PredictionCacheEntry).filter(
+                PredictionCacheEntry.model_fingerprint != self.fingerprint
+            ).delete(synchronize_session=False)
+            session.commit()
+            logger.info(f"Purged {deleted} stale cached predictions")
+            return deleted
+        finally:
+            session.close()
@@ -0,0 +1,65 @@
+import logging
+import requests
+from src.config import INFERENCE_URL, PROCESSED_DIR
+from src.processing.storage import name_of
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceClient:
+    """
+    Thin HTTP client for src/inference/server.py with the same predict /
+    predict_batch contract as ModelPredictor, so callers can swap them.
+    """
+
+    def __init__(self, base_url=None, timeout=30):
+        self.base_url = (base_url or INFERENCE_URL).rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session() # Keep-alive connection pool
+
+    def health(self):
+        try:
+            resp = self.session.get(f"{self.base_url}/health", timeout=self.timeout)
+            resp.raise_for_status()
+            return resp.json()
+        except Exception as e:
+            logger.error(f"Inference server unreachable: {e}")
+            return None
+
+    @property
+    def fingerprint(self):
+        """The served model's fingerprint (as stored in predicted_model), None if unreachable."""
+        health = self.health()
+        return health.get("fingerprint") if health else None
+
+    def predict(self, item):
+        """Processed-slice key, or raw image bytes (e.g. an upload)."""
+        try:
+            if isinstance(item, (bytes, bytearray)):
+                resp = self.session.post(
+                    f"{self.base_url}/predict/image", data=bytes(item),
+                    headers={"Content-Type": "application/octet-stream"}, timeout=self.timeout
+                )
+            else:
+                resp = self.session.post(
+                    f"{self.base_url}/predict", json={"key": name_of(item, PROCESSED_DIR)}, timeout=self.timeout
+                )
+            resp.raise_for_status()
+            result = resp.json()
+            return None if "error" in result else result
+        except Exception as e:
+            logger.error(f"Prediction error: {e}")
+            return None
+
+    def predict_batch(self, items, batch_size=None, num_workers=None):
+        """Per-item results; transport failures are reported against every item."""
+        try:
+            resp = self.session.post(
+                f"{self.base_url}/predict/batch", json={"keys": [name_of(k, PROCESSED_DIR) for k in items]},
+                timeout=self.timeout * 10
+            )
+            resp.raise_for_status()
+            return resp.json()["results"]
+        except Exception as e:
+            logger.error(f"Batch prediction error: {e}")
+            return [{"error": str(e)}] * len(items)
@@ -0,0 +1,91 @@
+import time
+import logging
+import argparse
+import numpy as np
+from src.training.dataset import NeuroSiftDataset
+from src.inference.predictor import ModelPredictor
+from src.inference.backends import BACKENDS
+from src.config import INPUT_SIZE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def measure(predictor, paths, batch_size=32, latency_samples=50):
+    """Accuracy inputs plus single-slice latency and batch throughput for one predictor."""
+    # Warm-up (compile/trace caches, allocator)
+    predictor.predict_batch(paths[:batch_size], batch_size=batch_size)
+
+    since = time.perf_counter()
+    results = predictor.predict_batch(paths, batch_size=batch_size)
+    elapsed = time.perf_counter() - since
+
+    latencies = []
+    for path in paths[:latency_samples]:
+        start = time.perf_counter()
+        predictor.predict(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "labels": [r.get("label") if r else None for r in results],
+        "throughput": len(paths) / max(elapsed, 1e-9),
+        "latency_ms": float(np.median(latencies)) if latencies else float("nan"),
+    }
+
+
+def compare_backends(backends=None, model_path="models/neurosift_resnet18.pth", channels_last=False,
+                     batch_size=32, max_drop=0.005):
+    """
+    Run every backend over the test split and compare with the fp32 eager
+    model: accuracy, agreement with fp32, median single-slice latency and
+    batched throughput. Returns False if any backend loses more than
+    max_drop accuracy against fp32.
+    """
+    backends = backends or BACKENDS
+    dataset = NeuroSiftDataset(split="test", target_classes=["T1", "T2", "FLAIR"], image_size=INPUT_SIZE)
+    paths = [item["path"] for item in dataset.data_index]
+    truth = [item["label"] for item in dataset.data_index]
+    if not paths:
+        logger.error("Test split is empty")
+        return False
+
+    reference = None
+    rows = []
+    for backend in ["eager"] + [b for b in backends if b != "eager"]:
+        predictor = ModelPredictor(
+            model_path, backend=backend, channels_last=channels_last and backend != "eager", cache=False
+        )
+        if predictor.model is None:
+            return False
+
+        stats = measure(predictor, paths, batch_size=batch_size)
+        accuracy = float(np.mean([p == t for p, t in zip(stats["labels"], truth)]))
+        if reference is None:
+            reference = stats
+            reference["accuracy"] = accuracy
+        agreement = float(np.mean([p == r for p, r in zip(stats["labels"], reference["labels"])]))
+        rows.append((backend, accuracy, agreement, stats["latency_ms"], stats["throughput"]))
+
+    print(f"\n{'backend':<14}{'acc':>8}{'agree':>8}{'p50 ms':>10}{'slices/s':>10}{'speedup':>9}")
+    ok = True
+    for backend, accuracy, agreement, latency, throughput in rows:
+        drop = reference["accuracy"] - accuracy
+        flag = "" if drop <= max_drop else "  << accuracy drop"
+        ok = ok and drop <= max_drop
+        print(
+            f"{backend:<14}{accuracy:>8.4f}{agreement:>8.4f}{latency:>10.2f}"
+            f"{throughput:>10.1f}{throughput / reference['throughput']:>8.2f}x{flag}"
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy parity and speed of CPU inference backends")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=None)
+    parser.add_argument("--model", default="models/neurosift_resnet18.pth")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    passed = compare_backends(args.backends, args.model, args.channels_last, args.batch_size)
+    raise SystemExit(0 if passed else 1)
@@ -1,61 +1,216 @@
 import torch
-from torchvision import transforms, models
-import torch.nn as nn
+import numpy as np
+from torchvision import transforms
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
 import logging
+from src.processing.tensor_store import is_tensor_key, load_slice
+from src.processing.storage import local_path
+from src.training.model import build_model, checkpoint_in_channels, normalize
+from src.training.checkpoint import resolve_model
+from src.inference.backends import optimize_model, calibration_items
+from src.inference.cache import PredictionCache, content_hash, file_fingerprint
+from src.instrumentation import timed
+from src.config import INFERENCE_BACKEND, INFERENCE_CHANNELS_LAST, PREDICTION_CACHE, INPUT_SIZE, MODEL_NAME
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ModelPredictor:
-    def __init__(self, model_path="models/neurosift_resnet18.pth"):
+    def __init__(self, model_path=None, backend=None, channels_last=None, cache=None, calibration=None):
+        # A checkpoint path, a training version tag or "latest" (see training/checkpoint.py)
+        model_path = resolve_model(MODEL_NAME if model_path is None else model_path)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.classes = ["T1", "T2", "FLAIR"]
+        self.in_channels = 1
+        self.backend = backend or INFERENCE_BACKEND
+        self.channels_last = INFERENCE_CHANNELS_LAST if channels_last is None else channels_last
         self.model = self._load_model(model_path)
+        # Decode/resize on one channel; only legacy RGB models get it expanded
         self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
+            transforms.Resize((INPUT_SIZE, INPUT_SIZE)), # No-op for slices read from the INPUT_SIZE tier
             transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+            normalize(self.in_channels)
         ])
+        if self.model is not None and self.backend != "eager":
+            self.model = self._optimize(self.model, calibration)
+
+        # Identifies this checkpoint + backend for cached / stored predictions
+        self.fingerprint = None
+        if self.model is not None:
+            self.fingerprint = f"{file_fingerprint(model_path)}:{self.backend}"
+
+        # Persistent prediction cache, keyed by that fingerprint
+        self.cache = None
+        use_cache = PREDICTION_CACHE if cache is None else cache
+        if self.model is not None and use_cache:
+            self.cache = PredictionCache(self.fingerprint)
+
+    def _optimize(self, model, calibration_keys=None):
+        calibration = None
+        if self.backend == "int8_static":
+            # Train-split slices from the catalog unless the caller brings its own
+            calibration = self._batches(calibration_keys or calibration_items(self.classes))
+        model = optimize_model(
+            model.cpu(),
+            backend=self.backend,
+            in_channels=self.in_channels,
+            channels_last=self.channels_last,
+            calibration_batches=calibration
+        )
+        # Optimized backends are CPU-only
+        self.device = torch.device("cpu")
+        logger.info(f"Inference backend: {self.backend} (channels_last={self.channels_last})")
+        return model
+
+    def _batches(self, items, batch_size=32):
+        for start in range(0, len(items), batch_size):
+            tensors = []
+            for item in items[start:start + batch_size]:
+                try:
+                    tensors.append(self._preprocess(item))
+                except Exception as e:
+                    logger.warning(f"Skipping calibration item {item}: {e}")
+            if tensors:
+                yield torch.stack(tensors)
 
     def _load_model(self, path):
         if not os.path.exists(path):
             logger.warning(f"Model not found at {path}")
             return None
             
-        model = models.resnet18(weights=None) # Structure only
-        num_ftrs = model.fc.in_features
-        model.fc = nn.Linear(num_ftrs, len(self.classes))
-        
         try:
-            model.load_state_dict(torch.load(path, map_location=self.device))
+            state_dict = torch.load(path, map_location=self.device)
+            # Grayscale (1-ch) and original RGB (3-ch) checkpoints both load
+            self.in_channels = checkpoint_in_channels(state_dict)
+            model = build_model(len(self.classes), in_channels=self.in_channels, pretrained=False) # Structure only
+            model.load_state_dict(state_dict)
             model = model.to(self.device)
             model.eval()
-            logger.info("Model loaded successfully.")
+            logger.info(f"Model loaded successfully ({self.in_channels}-channel input).")
             return model
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             return None
 
+    def _preprocess(self, item):
+        """Path, tensor-store key, encoded bytes or (H, W) array -> model input tensor (C, 224, 224)."""
+        if isinstance(item, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(item)).convert("L")
+        elif isinstance(item, np.ndarray):
+            image = Image.fromarray(item)
+            if image.mode != "L":
+                image = image.convert("L")
+        elif is_tensor_key(item):
+            image = Image.fromarray(load_slice(item))
+        else:
+            image = Image.open(local_path(item)).convert("L")
+        return self.transform(image)
+
+    @timed("model_forward")
+    def _forward(self, batch):
+        """Run a stacked batch and return one {"label", "confidence"} per row."""
+        batch = batch.to(self.device)
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            outputs = self.model(batch)
+            probabilities = torch.nn.functional.softmax(outputs, dim=1)
+            confidence, predicted = torch.max(probabilities, 1)
+
+        return [
+            {"label": self.classes[idx], "confidence": score}
+            for idx, score in zip(predicted.tolist(), confidence.tolist())
+        ]
+
+    @timed("predict")
     def predict(self, image_path):
-        if not self.model:
+        if self.model is None:
             return None
 
+        if self.cache is not None:
+            result = self.predict_batch([image_path], batch_size=1, num_workers=1)[0]
+            return None if "error" in result else result
+
         try:
-            image = Image.open(image_path).convert("RGB")
-            input_tensor = self.transform(image).unsqueeze(0).to(self.device)
-            
-            with torch.no_grad():
-                outputs = self.model(input_tensor)
-                probabilities = torch.nn.functional.softmax(outputs, dim=1)
-                confidence, predicted = torch.max(probabilities, 1)
-                
-                class_idx = predicted.item()
-                label = self.classes[class_idx]
-                score = confidence.item()
-                
-                return {"label": label, "confidence": score}
+            input_tensor = self._preprocess(image_path).unsqueeze(0)
+            return self._forward(input_tensor)[0]
         except Exception as e:
             logger.error(f"Prediction error: {e}")
             return None
+
+    @timed("predict_batch")
+    def predict_batch(self, items, batch_size=32, num_workers=4):
+        """
+        Batched inference over paths, tensor-store keys or arrays.
+        Decoding runs on a thread pool one batch ahead of the forward pass.
+        Returns one result per item, in order: {"label", "confidence"} or
+        {"error": message} for items that failed to load or run.
+        Items already in the prediction cache skip the model entirely.
+        """
+        if self.model is None:
+            return [None] * len(items)
+        if self.cache is None:
+            return self._predict_uncached(items, batch_size, num_workers)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            keys = list(pool.map(self._content_key, items))
+        found = self.cache.get_many([k for k in keys if k])
+
+        results = [dict(found[k]) if k in found else None for k in keys]
+        todo = [i for i, r in enumerate(results) if r is None]
+        if todo:
+            fresh = self._predict_uncached([items[i] for i in todo], batch_size, num_workers)
+            new = {}
+            for i, res in zip(todo, fresh):
+                results[i] = res
+                if keys[i] and res and "error" not in res:
+                    new[keys[i]] = res
+            self.cache.put_many(new)
+        return results
+
+    @staticmethod
+    def _content_key(item):
+        try:
+            return content_hash(item)
+        except Exception:
+            return None # Unreadable; the uncached path reports the error
+
+    def _predict_uncached(self, items, batch_size=32, num_workers=4):
+        results = [None] * len(items)
+        batches = [range(i, min(i + batch_size, len(items))) for i in range(0, len(items), batch_size)]
+
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            def submit(indices):
+                return [pool.submit(self._preprocess, items[i]) for i in indices]
+
+            pending = submit(batches[0]) if batches else []
+            for k, indices in enumerate(batches):
+                futures = pending
+                if k + 1 < len(batches):
+                    # Decode the next batch while this one runs through the model
+                    pending = submit(batches[k + 1])
+
+                tensors = []
+                ok = []
+                for i, future in zip(indices, futures):
+                    try:
+                        tensors.append(future.result())
+                        ok.append(i)
+                    except Exception as e:
+                        logger.error(f"Preprocessing error for item {i}: {e}")
+                        results[i] = {"error": str(e)}
+
+                if not tensors:
+                    continue
+                try:
+                    for i, res in zip(ok, self._forward(torch.stack(tensors))):
+                        results[i] = res
+                except Exception as e:
+                    logger.error(f"Batch prediction error: {e}")
+                    for i in ok:
+                        results[i] = {"error": str(e)}
+
+        return results
@@ -0,0 +1,254 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import numpy as np
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from src.config import INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT_MS, PROCESSED_DIR
+from src.inference.predictor import ModelPredictor
+from src.processing.storage import get_storage
+from src.processing.tensor_store import KEY_SEPARATOR
+from src import instrumentation
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Interactive requests jump ahead of bulk ones so viewers never wait behind a big job
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class DynamicBatcher:
+    """
+    Collects queued requests into batches of up to max_batch_size, waiting
+    at most max_wait_ms after the first request, and runs each batch through
+    ModelPredictor.predict_batch on a dedicated model thread.
+    """
+
+    def __init__(self, predictor, max_batch_size=None, max_wait_ms=None):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size or INFERENCE_MAX_BATCH
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else INFERENCE_MAX_WAIT_MS) / 1000.0
+        self.queue = asyncio.PriorityQueue()
+        self.executor = ThreadPoolExecutor(max_workers=1) # One warm model, one forward at a time
+        self._seq = 0
+        self._task = None
+
+        # Metrics
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.latencies = deque(maxlen=2000) # Seconds, queue + inference
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, item, priority=PRIORITY_INTERACTIVE):
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        await self.queue.put((priority, self._seq, item, future, time.perf_counter()))
+        self.requests += 1
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued first, then wait out the window
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [entry[2] for entry in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.predictor.predict_batch, items, len(items)
+                )
+            except Exception as e:
+                logger.error(f"Batch failed: {e}")
+                results = [{"error": str(e)}] * len(items)
+
+            self.batches += 1
+            self.batched_items += len(items)
+            now = time.perf_counter()
+            for (priority, seq, item, future, enqueued), result in zip(batch, results):
+                self.latencies.append(now - enqueued)
+                if result is None or "error" in result:
+                    self.errors += 1
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self):
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "requests_total": self.requests,
+            "errors_total": self.errors,
+            "batches_total": self.batches,
+            "avg_batch_size": self.batched_items / self.batches if self.batches else 0.0,
+            "queue_depth": self.queue.qsize(),
+            "latency_ms_p50": float(np.percentile(lat, 50)),
+            "latency_ms_p95": float(np.percentile(lat, 95)),
+            "latency_ms_p99": float(np.percentile(lat, 99)),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class PredictRequest(BaseModel):
+    key: str
+
+
+class BatchPredictRequest(BaseModel):
+    keys: List[str]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    predictor = ModelPredictor()
+    app.state.predictor = predictor
+    app.state.batcher = DynamicBatcher(predictor)
+    app.state.batcher.start()
+    yield
+    await app.state.batcher.stop()
+
+
+app = FastAPI(title="NeuroSift Inference", lifespan=lifespan)
+
+
+class InvalidKey(ValueError):
+    pass
+
+
+def resolve_key(key):
+    """
+    Stored slice for a client key: a name relative to the processed-slice
+    storage (tensor-store keys keep their #offset). Absolute paths, URLs
+    and ".." are refused, so a caller can only reach processed slices, never
+    arbitrary files on the server. Raises InvalidKey for malformed keys
+    and returns None for names that are not stored.
+    """
+    name, sep, offset = key.partition(KEY_SEPARATOR)
+    parts = name.replace("\\", "/").split("/")
+    if not name or os.path.isabs(name) or "://" in name or ".." in parts or (sep and not offset.isdigit()):
+        raise InvalidKey(key)
+    storage = get_storage(PROCESSED_DIR)
+    stored = storage.key(name)
+    if not storage.exists(stored):
+        return None
+    return stored + sep + offset
+
+
+def _check(result):
+    if result is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if "error" in result:
+        # Details stay in the server log, not in the response
+        return {"error": "prediction failed"}
+    return result
+
+
+@app.post("/predict")
+async def predict(req: PredictRequest):
+    """Single processed slice by storage name or tensor-store key (interactive priority)."""
+    try:
+        stored = await asyncio.to_thread(resolve_key, req.key) # exists() may be a HEAD request
+    except InvalidKey:
+        raise HTTPException(status_code=422, detail="Invalid key")
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Slice not found")
+    result = _check(await app.state.batcher.submit(stored))
+    if "error" in result:
+        raise HTTPException(status_code=422, detail="Prediction failed")
+    return result
+
+
+@app.post("/predict/batch")
+async def predict_batch(req: BatchPredictRequest):
+    """Many slices for bulk clients; queued behind interactive requests."""
+    batcher = app.state.batcher
+
+    async def one(key):
+        try:
+            stored = await asyncio.to_thread(resolve_key, key)
+        except InvalidKey:
+            return {"error": "invalid key"}
+        if stored is None:
+            return {"error": "not found"}
+        return _check(await batcher.submit(stored, PRIORITY_BULK))
+
+    return {"results": await asyncio.gather(*[one(key) for key in req.keys])}
+
+
+@app.post("/predict/image")
+async def predict_image(request: Request):
+    """Raw encoded image bytes in the body (uploads not on the shared volume)."""
+    body = await request.body()
+    return _check(await app.state.batcher.submit(body))
+
+
+@app.get("/health")
+async def health():
+    predictor = app.state.predictor
+    return {
+        "status": "ok" if predictor.model is not None else "no_model",
+        "backend": predictor.backend,
+        "fingerprint": predictor.fingerprint,
+        "queue_depth": app.state.batcher.queue.qsize(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return app.state.batcher.metrics()
+
+
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def metrics_prometheus():
+    """Batcher gauges plus this process' instrumentation timers, for a Prometheus scrape."""
+    lines = []
+    for name, value in app.state.batcher.metrics().items():
+        metric = f"neurosift_server_{name}"
+        lines.append(f"# TYPE {metric} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.append(f"{metric} {value}")
+    snapshot = instrumentation.registry.snapshot()
+    return "\n".join(lines) + "\n" + instrumentation.prometheus_text(snapshot)
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+    parser = argparse.ArgumentParser(description="NeuroSift inference server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
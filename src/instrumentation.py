@@ -0,0 +1,383 @@
+"""
+Low-overhead timers and counters for the hot paths of ingest, training
+and inference.
+
+Off by default: with INSTRUMENTATION unset, timed() returns the function
+unchanged and timer() is a shared no-op context, so nothing is measured
+and nothing is paid. Set INSTRUMENTATION=true to turn it on for any
+entry point without touching code:
+
+- Every process (pool workers, DataLoader workers) keeps its own registry
+  and periodically writes a snapshot to <INSTRUMENTATION_DIR>/<run>/.
+- When the main process exits, snapshots are merged into metrics.prom
+  (Prometheus text format), metrics.json and, with INSTRUMENTATION_TRACE,
+  trace.json (Chrome trace events: chrome://tracing, Perfetto), and a
+  summary is logged.
+- INSTRUMENTATION_PROFILE=cprofile dumps a .prof per process (snakeviz,
+  pstats). INSTRUMENTATION_PROFILE=sample runs a stack sampler every
+  INSTRUMENTATION_SAMPLE_MS and writes folded stacks (the py-spy raw /
+  flamegraph.pl / speedscope format).
+
+Worker processes that exit normally (Pool.close + join, executor
+shutdown, DataLoader teardown) flush on exit through a multiprocessing
+finalizer; between exits snapshots are flushed at most every
+FLUSH_INTERVAL seconds, so a worker that is killed loses at most that
+much data.
+"""
+import os
+import sys
+import json
+import time
+import glob
+import atexit
+import bisect
+import logging
+import threading
+import functools
+import multiprocessing
+from multiprocessing import util
+from collections import deque, Counter
+from contextlib import nullcontext
+from src.config import (
+    INSTRUMENTATION, INSTRUMENTATION_DIR, INSTRUMENTATION_TRACE, INSTRUMENTATION_PROFILE, INSTRUMENTATION_SAMPLE_MS
+)
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 2.0
+# Spans kept per process for the trace file
+TRACE_LIMIT = 200000
+# Tells child processes (including spawned ones) which run directory to write to
+RUN_ENV = "NEUROSIFT_METRICS_RUN"
+
+_NOOP = nullcontext()
+
+
+class Timer:
+    __slots__ = ("name", "count", "total", "max", "buckets", "_lock")
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+class _Span:
+    """Context manager timing one call into a Timer (and the trace)."""
+    __slots__ = ("registry", "timer", "start")
+
+    def __init__(self, registry, timer):
+        self.registry = registry
+        self.timer = timer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.timer.observe(end - self.start)
+        self.registry.after(self.timer.name, self.start, end)
+        return False
+
+
+class Registry:
+    def __init__(self, run_dir=None):
+        self.run_dir = run_dir
+        self.reset()
+
+    def reset(self, child=None):
+        self.pid = os.getpid()
+        self.timers = {}
+        self.counters = Counter()
+        self.spans = deque(maxlen=TRACE_LIMIT) if INSTRUMENTATION_TRACE else None
+        self.samples = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # Child processes never run atexit; they flush from a finalizer, registered
+        # on first use since multiprocessing clears finalizers when a child starts
+        self._needs_finalizer = multiprocessing.parent_process() is not None if child is None else child
+        # perf_counter origin, so trace timestamps line up across processes
+        self._epoch = time.time() - time.perf_counter()
+
+    def timer(self, name):
+        t = self.timers.get(name)
+        if t is None:
+            with self._lock:
+                t = self.timers.setdefault(name, Timer(name))
+        return t
+
+    def span(self, name):
+        return _Span(self, self.timer(name))
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+        self.maybe_flush()
+
+    def after(self, name, start, end):
+        if self.spans is not None:
+            self.spans.append((name, start, end, threading.get_ident()))
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if self._needs_finalizer:
+            self._needs_finalizer = False
+            util.Finalize(self, _flush_process, exitpriority=100)
+        if time.monotonic() - self._last_flush > FLUSH_INTERVAL:
+            self.flush()
+
+    def snapshot(self):
+        return {
+            "pid": self.pid,
+            "timers": {
+                name: {"count": t.count, "total": t.total, "max": t.max, "buckets": list(t.buckets)}
+                for name, t in list(self.timers.items())
+            },
+            "counters": dict(self.counters),
+        }
+
+    def flush(self):
+        """Write this process' snapshot (and spans / samples) into the run directory."""
+        self._last_flush = time.monotonic()
+        if not self.run_dir:
+            return
+        try:
+            os.makedirs(self.run_dir, exist_ok=True)
+            data = self.snapshot()
+            if self.spans is not None:
+                data["spans"] = [
+                    (name, (self._epoch + start) * 1e6, (end - start) * 1e6, tid)
+                    for name, start, end, tid in list(self.spans)
+                ]
+            _write_json(os.path.join(self.run_dir, f"metrics-{self.pid}.json"), data)
+            samples = dict(self.samples) # The sampler thread keeps adding
+            if samples:
+                with open(os.path.join(self.run_dir, f"samples-{self.pid}.folded"), "w") as f:
+                    for stack, n in sorted(samples.items(), key=lambda kv: -kv[1]):
+                        f.write(f"{stack} {n}\n")
+        except Exception as e:
+            logger.warning(f"Could not write metrics snapshot: {e}")
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _run_dir():
+    run = os.environ.get(RUN_ENV)
+    if not run:
+        prog = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+        run = os.path.join(INSTRUMENTATION_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{prog}-{os.getpid()}")
+        os.environ[RUN_ENV] = run
+    return run
+
+
+registry = Registry(_run_dir() if INSTRUMENTATION else None)
+
+
+def timed(name):
+    """Decorator timing every call of a function under name (identity when disabled)."""
+    def decorate(func):
+        if not INSTRUMENTATION:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with registry.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timer(name):
+    """Context manager timing a block under name (a shared no-op when disabled)."""
+    if not INSTRUMENTATION:
+        return _NOOP
+    return registry.span(name)
+
+
+def count(name, value=1):
+    if INSTRUMENTATION:
+        registry.incr(name, value)
+
+
+# Merging and export
+
+def merge(snapshots):
+    timers = {}
+    counters = Counter()
+    for snap in snapshots:
+        for name, t in snap.get("timers", {}).items():
+            m = timers.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "buckets": [0] * (len(BUCKETS) + 1)})
+            m["count"] += t["count"]
+            m["total"] += t["total"]
+            m["max"] = max(m["max"], t["max"])
+            m["buckets"] = [a + b for a, b in zip(m["buckets"], t["buckets"])]
+        counters.update(snap.get("counters", {}))
+    return {"timers": timers, "counters": dict(counters)}
+
+
+def load_run(run_dir):
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(run_dir, "metrics-*.json"))):
+        try:
+            with open(path, "r") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping {path}: {e}")
+    return snapshots
+
+
+def _metric_name(name, prefix="neurosift"):
+    return f"{prefix}_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text(merged, prefix="neurosift"):
+    """Prometheus exposition format: one histogram per timer, one counter per counter."""
+    lines = []
+    for name, t in sorted(merged["timers"].items()):
+        metric = _metric_name(name, prefix) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip(BUCKETS, t["buckets"]):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {t["count"]}')
+        lines.append(f"{metric}_sum {t['total']}")
+        lines.append(f"{metric}_count {t['count']}")
+    for name, value in sorted(merged["counters"].items()):
+        metric = _metric_name(name, prefix) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def trace_events(snapshots):
+    """Chrome trace "complete" events for every recorded span."""
+    events = []
+    for snap in snapshots:
+        for name, ts, dur, tid in snap.get("spans", []):
+            events.append({"name": name, "ph": "X", "ts": ts, "dur": dur, "pid": snap["pid"], "tid": tid})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def summary(merged):
+    rows = sorted(merged["timers"].items(), key=lambda kv: -kv[1]["total"])
+    lines = [f"{'timer':<24}{'calls':>10}{'total s':>10}{'mean ms':>10}{'max ms':>10}"]
+    for name, t in rows:
+        mean = 1000 * t["total"] / t["count"] if t["count"] else 0.0
+        lines.append(f"{name:<24}{t['count']:>10}{t['total']:>10.2f}{mean:>10.3f}{1000 * t['max']:>10.2f}")
+    for name, value in sorted(merged["counters"].items()):
+        lines.append(f"{name:<24}{value:>10}")
+    return "\n".join(lines)
+
+
+def write_reports(run_dir):
+    """Merge every process' snapshot in run_dir into metrics.prom / metrics.json / trace.json."""
+    snapshots = load_run(run_dir)
+    merged = merge(snapshots)
+    with open(os.path.join(run_dir, "metrics.prom"), "w") as f:
+        f.write(prometheus_text(merged))
+    _write_json(os.path.join(run_dir, "metrics.json"), merged)
+    if any("spans" in s for s in snapshots):
+        _write_json(os.path.join(run_dir, "trace.json"), trace_events(snapshots))
+    return merged
+
+
+# Profiling modes
+
+class StackSampler(threading.Thread):
+    """Samples every thread's Python stack at a fixed interval into folded-stack counts."""
+
+    def __init__(self, registry, interval_ms):
+        super().__init__(name="instrumentation-sampler", daemon=True)
+        self.registry = registry
+        self.interval = interval_ms / 1000.0
+
+    def run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                self.registry.samples[";".join(reversed(stack))] += 1
+
+
+_profiler = None
+
+
+def _start_profiling():
+    global _profiler
+    if INSTRUMENTATION_PROFILE == "cprofile":
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    elif INSTRUMENTATION_PROFILE == "sample":
+        StackSampler(registry, INSTRUMENTATION_SAMPLE_MS).start()
+
+
+def _after_fork():
+    # A forked worker starts from its own zero, not a copy of the parent's counts
+    registry.reset(child=True) # parent_process() is not set yet at this point
+    _start_profiling()
+
+
+def _flush_process():
+    """Final snapshot (and profile) of this process."""
+    if _profiler is not None:
+        _profiler.disable()
+        os.makedirs(registry.run_dir, exist_ok=True)
+        _profiler.dump_stats(os.path.join(registry.run_dir, f"profile-{os.getpid()}.prof"))
+    registry.flush()
+
+
+def _at_exit():
+    _flush_process()
+
+    if multiprocessing.parent_process() is None:
+        merged = write_reports(registry.run_dir)
+        if merged["timers"] or merged["counters"]:
+            logger.info(f"Instrumentation ({registry.run_dir}):\n{summary(merged)}")
+
+
+if INSTRUMENTATION:
+    _start_profiling()
+    atexit.register(_at_exit)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Merge and print the metrics of an instrumented run")
+    parser.add_argument("run_dir")
+    parser.add_argument("--format", choices=["summary", "prometheus"], default="summary")
+    args = parser.parse_args()
+
+    merged = write_reports(args.run_dir)
+    print(summary(merged) if args.format == "summary" else prometheus_text(merged))
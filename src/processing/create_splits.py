@@ -1,15 +1,15 @@
 import json
 import random
+import hashlib
 import os
-from src.collector.metadata_store import MetadataStore, ImageMetadata
+from src.processing.series_index import SeriesIndex
 
 def create_splits():
-    store = MetadataStore()
-    session = store.Session()
+    index = SeriesIndex()
+    index.ensure()
     
     # Get all unique Patient IDs
-    patients_query = session.query(ImageMetadata.pmc_id).distinct().all()
-    patients = [p[0] for p in patients_query]
+    patients = index.list_patients()
     
     # Shuffle and Split (80/20)
     random.seed(42) # Reproducibility
@@ -29,7 +29,37 @@ def create_splits():
         json.dump(splits, f, indent=4)
         
     print(f"Split created: {len(train_patients)} Train Patients, {len(test_patients)} Test Patients.")
-    session.close()
+
+def assign_patients(patient_ids, path="data/splits.json", train_fraction=0.8):
+    """
+    Add new patients to an existing split file without moving anyone
+    already assigned, so slices can become trainable while ingestion is
+    still running. A new patient's side is fixed by a hash of its ID.
+    Returns {patient_id: split} for the patients passed in.
+    """
+    try:
+        with open(path, "r") as f:
+            splits = json.load(f)
+    except FileNotFoundError:
+        splits = {"train": [], "test": []}
+
+    assigned = {pid: name for name, pids in splits.items() for pid in pids}
+    result = {}
+    changed = False
+    for pid in patient_ids:
+        if pid not in assigned:
+            bucket = int(hashlib.sha1(pid.encode()).hexdigest(), 16) % 100
+            assigned[pid] = "train" if bucket < train_fraction * 100 else "test"
+            splits.setdefault(assigned[pid], []).append(pid)
+            changed = True
+        result[pid] = assigned[pid]
+
+    if changed:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(splits, f, indent=4)
+        os.replace(tmp_path, path)
+    return result
 
 if __name__ == "__main__":
     create_splits()
@@ -1,22 +1,239 @@
 import os
+import re
+import time
+import hashlib
 import pydicom
 import numpy as np
 import cv2
 import logging
-from src.config import LOCAL_DATA_DIR
-from src.collector.metadata_store import MetadataStore, ImageMetadata
+from multiprocessing import Pool
+from src.config import LOCAL_DATA_DIR, PROCESSED_DIR, PROCESSING_WORKERS, PROCESSING_CHUNK_SIZE, DB_BATCH_SIZE, NORMALIZATION_MODE, OUTPUT_BACKEND, SLICE_TIERS
+from src.collector.metadata_store import MetadataStore, ImageMetadata, SourceManifest
+from src.processing.series_index import SeriesIndex, list_dicom_files
+from src.processing.tensor_store import TensorStore, is_tensor_key, split_key, tier_key, parse_tiers
+from src.processing import storage
+from src.processing.storage import get_storage
+from src.instrumentation import timed, timer, count as incr
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Output name used before the source manifest: {pid}_{series_uid[-5:]}_{n}.png,
+# n being the file's 1-based position in the raw tree walk
+LEGACY_NAME = re.compile(r"^(?P<pid>.*)_(?P<suffix>[^_]*)_(?P<n>\d+)\.png$")
+# Set after conversion (labeler, bulk scoring); reconverting a slice keeps them
+KEPT_COLUMNS = ("modality", "predicted_label", "predicted_confidence", "predicted_model")
+
+
+def file_digest(path, chunk=1 << 20):
+    """MD5 of a file's content, read in 1MB blocks."""
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def slice_token(rel_path):
+    """Stable per-source suffix for output names, so re-runs overwrite instead of duplicating."""
+    return hashlib.sha1(rel_path.encode("utf-8")).hexdigest()[:10]
+
+
+def matches_legacy(task):
+    """Whether a legacy PNG holds exactly this DICOM's windowed pixels. Module-level for the pool."""
+    path, png_path = task
+    img, ds = DicomProcessor.read_dicom(path)
+    legacy = cv2.imread(png_path, cv2.IMREAD_UNCHANGED)
+    if img is None or legacy is None:
+        return False
+    return np.array_equal(DicomProcessor.apply_window(img, 40, 80), legacy)
+
+
+def convert_file(task):
+    """
+    Read, window and encode a single DICOM slice.
+    Module-level so it can be pickled into pool workers; only the row
+    dict goes back to the parent, never the pixel data.
+    """
+    token, path, processed_dir = task
+    img, ds = DicomProcessor.read_dicom(path)
+    if img is None:
+        return None
+
+    # Windowing
+    w_img = DicomProcessor.apply_window(img, 40, 80)
+
+    return save_slice(token, path, processed_dir, ds, w_img)
+
+
+def convert_series(item):
+    """
+    Series-at-a-time counterpart of convert_file, used for volume
+    normalization and for the npy backend. Slices are stacked into a single
+    float32 volume; in volume mode the window is computed once for it.
+    The uint8 result is either encoded slice by slice to PNG or written as
+    one contiguous .npy for the tensor store.
+    """
+    tasks, normalization, backend = item
+    slices = []
+    for token, path, processed_dir in tasks:
+        img, ds = DicomProcessor.read_dicom(path)
+        slices.append((img, ds))
+
+    shapes = {img.shape for img, ds in slices if img is not None}
+    if len(shapes) != 1:
+        # Mixed matrix sizes (or nothing readable): fall back to per-slice PNGs
+        return [convert_file(task) for task in tasks]
+
+    shape = shapes.pop()
+    valid = [i for i, (img, ds) in enumerate(slices) if img is not None]
+    volume = np.empty((len(valid),) + shape, dtype=np.float32)
+    for n, i in enumerate(valid):
+        volume[n] = slices[i][0]
+        slices[i] = (None, slices[i][1]) # Drop the per-slice copy early
+
+    if normalization == "volume":
+        windowed = DicomProcessor.apply_window_volume(volume)
+    else:
+        windowed = np.empty(volume.shape, dtype=np.uint8)
+        for n in range(len(valid)):
+            windowed[n] = DicomProcessor.apply_window(volume[n], 40, 80)
+
+    results = [None] * len(tasks)
+    if backend == "npy":
+        first_ds = slices[valid[0]][1]
+        processed_dir = tasks[0][2]
+        pid = getattr(first_ds, 'PatientID', 'Unknown')
+        series_uid = getattr(first_ds, 'SeriesInstanceUID', 'Unknown')
+        name = f"{pid}_{hashlib.sha1(series_uid.encode('utf-8')).hexdigest()[:16]}"
+        store = TensorStore(processed_dir)
+        store_path = store.write_series(name, windowed)
+        tiers = []
+        for size in tier_sizes(windowed.shape[1:]):
+            store.write_series(name, np.stack([resize_tier(img, size) for img in windowed]), tier=size)
+            tiers.append(size)
+        slice_bytes = windowed[0].nbytes
+        for n, i in enumerate(valid):
+            token, path, processed_dir = tasks[i]
+            results[i] = slice_record(
+                token, path, slices[i][1], TensorStore.key(store_path, n), ".npy", slice_bytes, tiers
+            )
+        return results
+
+    # Encode the whole series, then write it as one batch (concurrent uploads on S3)
+    encoded = []
+    for n, i in enumerate(valid):
+        token, path, processed_dir = tasks[i]
+        out = encode_slice(token, path, slices[i][1], windowed[n])
+        if out is not None:
+            encoded.append((i, out))
+
+    keys = iter(get_storage(tasks[0][2]).put_many([item for i, (outputs, tiers) in encoded for item in outputs]))
+    for i, (outputs, tiers) in encoded:
+        token, path, processed_dir = tasks[i]
+        stored = [next(keys) for _ in outputs]
+        results[i] = stored_record(token, path, slices[i][1], outputs, tiers, stored)
+    return results
+
+
+def tier_sizes(shape):
+    """Configured tiers smaller than the slice; larger ones would only upscale."""
+    return [size for size in SLICE_TIERS if max(shape) > size]
+
+
+def resize_tier(img, size):
+    return cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def encode_slice(token, path, ds, w_img):
+    """
+    PNG-encode a windowed slice and its pre-resized tiers. Returns
+    ([(name, bytes)], tier sizes) with the original first, or None.
+    """
+    pid = getattr(ds, 'PatientID', 'Unknown')
+    series_uid = getattr(ds, 'SeriesInstanceUID', 'Unknown')
+    out_filename = f"{pid}_{series_uid[-5:]}_{token}.png"
+
+    with timer("png_encode"):
+        is_success, buffer = cv2.imencode(".png", w_img)
+    if not is_success:
+        logger.error(f"Failed to encode {path}")
+        return None
+
+    outputs = [(out_filename, buffer.tobytes())]
+    tiers = []
+    for size in tier_sizes(w_img.shape):
+        with timer("png_encode"):
+            is_success, buffer = cv2.imencode(".png", resize_tier(w_img, size))
+        if is_success:
+            outputs.append((f"t{size}/{out_filename}", buffer.tobytes()))
+            tiers.append(size)
+    return outputs, tiers
+
+
+def stored_record(token, path, ds, outputs, tiers, keys):
+    """DB row for an encoded slice once written; tiers that failed to store are left out."""
+    if keys[0] is None:
+        return None
+    stored = [size for size, key in zip(tiers, keys[1:]) if key is not None]
+    return slice_record(token, path, ds, keys[0], ".png", len(outputs[0][1]), stored)
+
+
+def save_slice(token, path, processed_dir, ds, w_img):
+    """Encode a windowed slice (and its tiers) to PNG, write it and return its DB row."""
+    encoded = encode_slice(token, path, ds, w_img)
+    if encoded is None:
+        return None
+    outputs, tiers = encoded
+
+    # Save
+    try:
+        keys = get_storage(processed_dir).put_many(outputs)
+    except Exception as e:
+        logger.error(f"Failed to store {outputs[0][0]}: {e}")
+        return None
+
+    return stored_record(token, path, ds, outputs, tiers, keys)
+
+
+def slice_record(token, path, ds, s3_key, ext, bytes_out, tiers=None):
+    """DB row (plus stats for the parent) for one converted slice."""
+    # Metadata
+    pid = getattr(ds, 'PatientID', 'Unknown')
+    sex = getattr(ds, 'PatientSex', 'Unknown')
+    age = getattr(ds, 'PatientAge', 'Unknown')
+    modality = getattr(ds, 'Modality', 'MR')
+    series_uid = getattr(ds, 'SeriesInstanceUID', 'Unknown')
+
+    return {
+        "pmc_id": pid,
+        "graphic_id": f"{pid}_{series_uid[-5:]}_{token}{ext}",
+        "s3_key": s3_key,
+        "modality": modality,
+        "caption": f"Age: {age}, Sex: {sex}",
+        "is_valid": 1,
+        "series_uid": series_uid,
+        "instance_number": int(getattr(ds, 'InstanceNumber', 0) or 0),
+        "tiers": ",".join(str(t) for t in tiers) if tiers else None,
+        "bytes_in": os.path.getsize(path),
+        "bytes_out": bytes_out,
+        "content_hash": file_digest(path),
+    }
+
+
 class DicomProcessor:
-    def __init__(self):
+    def __init__(self, backend=None):
+        # backend: "png" files or "npy" tensor store (see tensor_store.py)
+        self.backend = backend or OUTPUT_BACKEND
         self.raw_dir = os.path.join(LOCAL_DATA_DIR, "dicom")
-        self.processed_dir = os.path.join(LOCAL_DATA_DIR, "processed")
+        self.processed_dir = PROCESSED_DIR
         os.makedirs(self.processed_dir, exist_ok=True)
         self.store = MetadataStore()
+        self.index = SeriesIndex(store=self.store, raw_dir=self.raw_dir)
 
-    def apply_window(self, image, center=None, width=None):
+    @staticmethod
+    @timed("apply_window")
+    def apply_window(image, center=None, width=None):
         # MRI robust normalization (Percentile scaling)
         # Ignore zeros (background) for calculation
         if np.max(image) == 0:
@@ -35,7 +252,48 @@ class DicomProcessor:
         
         return image
 
-    def read_dicom(self, path):
+    @staticmethod
+    def window_thresholds(volume, low=1, high=99):
+        """
+        p1/p99 of the non-zero voxels using np.partition (O(n)) instead of
+        the two full sorts np.percentile does. Nearest-rank, no interpolation.
+        """
+        foreground = volume[volume > 0]
+        if foreground.size == 0:
+            return None
+        last = foreground.size - 1
+        k_low = int(round(last * low / 100.0))
+        k_high = int(round(last * high / 100.0))
+        part = np.partition(foreground, (k_low, k_high))
+        return float(part[k_low]), float(part[k_high])
+
+    @staticmethod
+    @timed("apply_window")
+    def apply_window_volume(volume, out=None):
+        """
+        Series-level variant of apply_window for a (slices, h, w) float32
+        volume. One threshold pair for the whole series, so there is no
+        intensity jitter between slices. Clips and scales in place (volume is
+        overwritten) and writes into out, a preallocated uint8 buffer.
+        """
+        if out is None:
+            out = np.empty(volume.shape, dtype=np.uint8)
+
+        thresholds = DicomProcessor.window_thresholds(volume)
+        if thresholds is None:
+            out.fill(0)
+            return out
+
+        p1, p99 = thresholds
+        np.clip(volume, p1, p99, out=volume)
+        volume -= p1
+        volume *= 255.0 / (p99 - p1 + 1e-8)
+        np.copyto(out, volume, casting='unsafe') # Truncates, like astype(uint8)
+        return out
+
+    @staticmethod
+    @timed("dicom_read")
+    def read_dicom(path):
         try:
             ds = pydicom.dcmread(path)
             image = ds.pixel_array.astype(np.float32)
@@ -50,88 +308,418 @@ class DicomProcessor:
             logger.error(f"Error reading {path}: {e}")
             return None, None
 
-    def process_patient(self, patient_id):
-        patient_dir = os.path.join(self.raw_dir, patient_id)
-        images = []
-        
-        for root, dirs, files in os.walk(self.raw_dir):
-            if patient_id not in root:
-                continue
-                
-            for file in files:
-                if file.endswith(".dcm"):
-                    full_path = os.path.join(root, file)
-                    img, ds = self.read_dicom(full_path)
-                    
-                    if img is not None:
-                        # Brain window
-                        windowed = self.apply_window(img, center=40, width=80)
-                        
-                        # Output path
-                        out_name = f"{patient_id}_{ds.SeriesInstanceUID[-5:]}_{ds.InstanceNumber}.png"
-                        out_path = os.path.join(self.processed_dir, out_name)
-                        
-                        # Write image
-                        is_success, buffer = cv2.imencode(".png", windowed)
-                        if is_success:
-                            with open(out_path, "wb") as f:
-                                f.write(buffer)
-                            images.append(out_path)
-                            logger.info(f"Saved {out_path}")
-                        else:
-                            logger.error(f"Failed to save {out_path}")
-                        
-        logger.info(f"Processed {len(images)} images for {patient_id}")
-
-    def run(self):
+    def _per_series(self, normalization):
+        return normalization == "volume" or self.backend == "npy"
+
+    def _convert_all(self, tasks, workers, chunk_size, normalization="slice", executor=None):
+        """
+        Yield per-file results in task order, in a pool when workers > 1.
+        A caller-owned executor (e.g. the ingest pipeline's shared process
+        pool) is used instead of starting a new pool.
+        """
+        per_series = self._per_series(normalization)
+        if per_series:
+            # Consecutive tasks of one series form a single work item
+            func = convert_series
+            items = [(group, normalization, self.backend) for group in self._group_by_series(tasks)]
+            chunk_size = 1
+        else:
+            func = convert_file
+            items = [task for task, series_uid in tasks]
+
+        if executor is not None:
+            for result in executor.map(func, items, chunksize=chunk_size):
+                yield from (result if per_series else [result])
+            return
+
+        if workers <= 1:
+            for result in map(func, items):
+                yield from (result if per_series else [result])
+            return
+
+        pool = Pool(processes=workers)
+        try:
+            # imap keeps input order, so output names stay deterministic
+            for result in pool.imap(func, items, chunksize=chunk_size):
+                yield from (result if per_series else [result])
+            # Let workers exit on their own (and flush their instrumentation)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    @staticmethod
+    def _group_by_series(tasks):
+        groups = []
+        current = None
+        for task, series_uid in tasks:
+            if current is None or series_uid != current:
+                groups.append([])
+                current = series_uid
+            groups[-1].append(task)
+        return groups
+
+    def adopt_legacy(self, refresh=True, workers=None, chunk_size=None, batch_size=None):
+        """
+        One-time upgrade of a catalog written before the source manifest
+        existed (the manifest is empty but slices are not). A legacy row is
+        matched to the file at its walk position if that file has the same
+        patient and series suffix and windows to exactly the stored PNG. It
+        then gets a manifest entry pointing at it, plus its full series_uid
+        and instance number, so incremental runs keep the row and its labels
+        instead of converting the slice again under its new name. Legacy
+        rows that cannot be matched are deleted with their PNG and
+        reconverted. Returns (adopted, dropped).
+        """
+        workers = workers or PROCESSING_WORKERS
+        chunk_size = chunk_size or PROCESSING_CHUNK_SIZE
+        batch_size = batch_size or DB_BATCH_SIZE
         session = self.store.Session()
-        count = 0 
-        
-        for root, dirs, files in os.walk(self.raw_dir):
-            for file in files:
-                if file.endswith(".dcm"):
-                    count += 1
-                    if count % 50 == 0:
-                        logger.info(f"Processing image {count}...")
-                        
-                    path = os.path.join(root, file)
-                    img, ds = self.read_dicom(path)
-                    
-                    if img is not None:
-                        # Metadata
-                        pid = getattr(ds, 'PatientID', 'Unknown')
-                        sex = getattr(ds, 'PatientSex', 'Unknown')
-                        age = getattr(ds, 'PatientAge', 'Unknown')
-                        modality = getattr(ds, 'Modality', 'MR')
-                        series_uid = getattr(ds, 'SeriesInstanceUID', 'Unknown')
-                        
-                        # Windowing
-                        w_img = self.apply_window(img, 40, 80)
-                        
-                        # Save
-                        out_filename = f"{pid}_{series_uid[-5:]}_{count}.png"
-                        out_path = os.path.join(self.processed_dir, out_filename)
-                        
-                        is_success, buffer = cv2.imencode(".png", w_img)
-                        if is_success:
-                            with open(out_path, "wb") as f:
-                                f.write(buffer)
-                            
-                            # DB record
-                            meta = ImageMetadata(
-                                pmc_id=pid,
-                                graphic_id=out_filename,
-                                s3_key=out_path,
-                                modality=modality,
-                                caption=f"Age: {age}, Sex: {sex}",
-                                is_valid=1
-                            )
-                            session.add(meta)
+        try:
+            if session.query(SourceManifest.path).first() is not None:
+                return 0, 0
+            rows = session.query(
+                ImageMetadata.id, ImageMetadata.pmc_id, ImageMetadata.graphic_id, ImageMetadata.s3_key
+            ).filter(ImageMetadata.graphic_id.like("%.png")).all()
+            # The baseline wrote plain files named after graphic_id into processed_dir
+            legacy = [
+                (row_id, pid, graphic_id, s3_key, LEGACY_NAME.match(graphic_id))
+                for row_id, pid, graphic_id, s3_key in rows
+                if s3_key == os.path.join(self.processed_dir, graphic_id)
+            ]
+            legacy = [row for row in legacy if row[-1] is not None]
+            if not legacy:
+                return 0, 0
+
+            if refresh:
+                self.index.refresh(workers=workers, chunk_size=chunk_size, batch_size=batch_size)
+            walk = list_dicom_files(self.raw_dir)
+            instances = {inst.path: inst for inst in self.index.instances()}
+
+            candidates = []
+            for row_id, pid, graphic_id, s3_key, match in legacy:
+                n = int(match["n"])
+                inst = None
+                if 0 < n <= len(walk):
+                    inst = instances.get(os.path.relpath(walk[n - 1], self.raw_dir))
+                if (inst is not None and pid == match["pid"] and inst.patient_id == pid
+                        and inst.series_uid[-5:] == match["suffix"]):
+                    candidates.append(inst)
+                else:
+                    candidates.append(None)
+
+            # Positions shift when files were added or removed since, so compare pixels too
+            checks = [(self.index.abspath(inst.path), row[3]) for row, inst in zip(legacy, candidates) if inst]
+            if workers > 1 and len(checks) > chunk_size:
+                with Pool(processes=workers) as pool:
+                    same = iter(pool.map(matches_legacy, checks, chunksize=chunk_size))
+            else:
+                same = iter([matches_legacy(c) for c in checks])
+
+            manifest = []
+            updates = []
+            dropped = []
+            for (row_id, pid, graphic_id, s3_key, match), inst in zip(legacy, candidates):
+                if inst is None or not next(same):
+                    dropped.append((row_id, s3_key))
+                    continue
+                manifest.append({
+                    "path": inst.path,
+                    "size": inst.file_size,
+                    "mtime": inst.mtime,
+                    "content_hash": file_digest(self.index.abspath(inst.path)),
+                    "output_key": graphic_id,
+                })
+                updates.append({
+                    "id": row_id,
+                    "series_uid": inst.series_uid,
+                    "instance_number": inst.instance_number or 0,
+                })
+
+            session.bulk_insert_mappings(SourceManifest, manifest)
+            session.bulk_update_mappings(ImageMetadata, updates)
+            for i in range(0, len(dropped), batch_size):
+                session.query(ImageMetadata).filter(
+                    ImageMetadata.id.in_([row_id for row_id, key in dropped[i:i + batch_size]])
+                ).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+        for row_id, key in dropped:
+            try:
+                if os.path.exists(key):
+                    os.remove(key)
+            except OSError as e:
+                logger.error(f"Failed to remove legacy slice {key}: {e}")
+
+        logger.info(f"Legacy catalog: {len(manifest)} slices adopted into the manifest, {len(dropped)} dropped for reconversion")
+        return len(manifest), len(dropped)
+
+    def plan(self, instances, session, incremental=True, normalization="slice"):
+        """
+        Compare series index rows against the manifest and return
+        (tasks, entries, skipped). A known file is skipped when its size and
+        mtime are unchanged, or when only its mtime moved but the content
+        hash still matches. In volume mode (and for the npy backend) a change
+        anywhere in a series reconverts the whole series, since its slices
+        share one window / one file.
+        """
+        # Only the manifest rows of these files, so planning one series stays cheap
+        paths = [inst.path for inst in instances]
+        known = {}
+        for i in range(0, len(paths), DB_BATCH_SIZE):
+            for m in session.query(SourceManifest).filter(SourceManifest.path.in_(paths[i:i + DB_BATCH_SIZE])):
+                known[m.path] = m
+
+        changed = []
+        for inst in instances:
+            entry = known.get(inst.path)
+            is_changed = True
+
+            if incremental and entry is not None:
+                if entry.size == inst.file_size and entry.mtime == inst.mtime:
+                    is_changed = False
+                elif entry.size == inst.file_size and entry.content_hash == file_digest(self.index.abspath(inst.path)):
+                    # Touched but identical, just refresh the stat
+                    entry.mtime = inst.mtime
+                    is_changed = False
+            changed.append(is_changed)
+
+        if self._per_series(normalization):
+            dirty = {inst.series_uid for inst, c in zip(instances, changed) if c}
+            changed = [inst.series_uid in dirty for inst in instances]
+
+        tasks = []
+        entries = []
+        skipped = 0
+
+        for inst, is_changed in zip(instances, changed):
+            if not is_changed:
+                skipped += 1
+                continue
+
+            rel = inst.path
+            path = self.index.abspath(rel)
+            entry = known.get(rel)
+
+            tasks.append(((slice_token(rel), path, self.processed_dir), inst.series_uid))
+            entries.append({
+                "path": rel,
+                "size": inst.file_size,
+                "mtime": inst.mtime,
+                "old_key": entry.output_key if entry is not None else None,
+            })
 
         session.commit()
-        session.close()
-        logger.info(f"Total processed: {count}")
+        return tasks, entries, skipped
+
+    def _flush(self, session, rows, entries):
+        """
+        Write one batch of slices and their manifest entries in a single
+        transaction. Slices already in the catalog are updated in place, so
+        their modality label and stored prediction survive reconversion; a
+        slice whose output name moved takes them over from its old row.
+        """
+        moved = {
+            e["output_key"]: e["old_key"]
+            for e in entries if e["old_key"] and e["old_key"] != e["output_key"]
+        }
+        kept = {}
+        orphans = []
+        if moved:
+            old = session.query(
+                ImageMetadata.graphic_id, ImageMetadata.s3_key, ImageMetadata.tiers,
+                *[getattr(ImageMetadata, c) for c in KEPT_COLUMNS]
+            ).filter(ImageMetadata.graphic_id.in_(list(moved.values()))).all()
+            kept = {r[0]: dict(zip(KEPT_COLUMNS, r[3:])) for r in old}
+            orphans = [(r.s3_key, r.tiers) for r in old if r.s3_key]
+            session.query(ImageMetadata).filter(
+                ImageMetadata.graphic_id.in_(list(moved.values()))
+            ).delete(synchronize_session=False)
+        for row in rows:
+            # Every row carries the same keys, as executemany needs
+            row.update({c: None for c in KEPT_COLUMNS if c not in row})
+            row.update(kept.get(moved.get(row["graphic_id"]), {}))
+
+        session.query(SourceManifest).filter(
+            SourceManifest.path.in_([e["path"] for e in entries])
+        ).delete(synchronize_session=False)
+
+        updated = [c for c in rows[0] if c not in KEPT_COLUMNS and c not in ("pmc_id", "graphic_id")]
+        session.execute(self.store.upsert(ImageMetadata, ["pmc_id", "graphic_id"], updated), rows)
+        session.bulk_insert_mappings(SourceManifest, [
+            {
+                "path": e["path"],
+                "size": e["size"],
+                "mtime": e["mtime"],
+                "content_hash": e["content_hash"],
+                "output_key": e["output_key"],
+            }
+            for e in entries
+        ])
+        with timer("db_commit"):
+            session.commit()
+
+        # Output name moved (e.g. PatientID fixed upstream): drop the orphans
+        self._remove_outputs(session, orphans)
+
+    def _remove_outputs(self, session, outputs):
+        """
+        Delete the stored slices (s3_key, tiers) of rows that are gone. A
+        series volume is shared by all its slices, so it is only removed
+        once no row points into it any more.
+        """
+        volumes = {}
+        for key, tiers in outputs:
+            if is_tensor_key(key):
+                volumes[split_key(key)[0]] = tiers
+                continue
+            try:
+                storage.delete(key)
+                for size in parse_tiers(tiers):
+                    storage.delete(tier_key(key, size))
+            except Exception as e:
+                logger.error(f"Failed to remove orphan {key}: {e}")
+
+        tensors = TensorStore(self.processed_dir)
+        for path, tiers in volumes.items():
+            in_use = session.query(ImageMetadata.id).filter(
+                ImageMetadata.s3_key.startswith(TensorStore.key(path, ""), autoescape=True)
+            ).first()
+            if in_use is not None:
+                continue
+            try:
+                tensors.delete_series(path, tiers)
+            except Exception as e:
+                logger.error(f"Failed to remove orphan volume {path}: {e}")
+
+    def process_patients(self, patient_ids, workers=None, chunk_size=None, batch_size=None, incremental=False, normalization=None):
+        """
+        Reprocess a list of patients in parallel. Only the index folders of
+        those patients plus top-level folders not indexed yet (new series
+        downloads, for new or known patients) are walked; a patient still
+        not found after that triggers a full index refresh.
+        """
+        options = {"workers": workers, "chunk_size": chunk_size, "batch_size": batch_size}
+        self.adopt_legacy(**options)
+        self.index.ensure()
+        roots = set(self.index.unindexed_dirs())
+        for pid in patient_ids:
+            roots.update(self.index.patient_dirs(pid))
+
+        if "" in roots:
+            self.index.refresh(**options)
+        else:
+            self.index.refresh(roots=sorted(roots), **options)
+            if any(not self.index.patient_dirs(pid) for pid in patient_ids):
+                self.index.refresh(**options)
+
+        instances = self.index.instances(patient_ids=list(patient_ids))
+        logger.info(f"{len(instances)} indexed files for {len(patient_ids)} patient(s)")
+        return self._process(instances, workers, chunk_size, batch_size, incremental, normalization)
+
+    def process_patient(self, patient_id, incremental=False):
+        saved = self.process_patients([patient_id], incremental=incremental)
+        logger.info(f"Processed {saved} images for {patient_id}")
+        return saved
+
+    def run(self, workers=None, chunk_size=None, batch_size=None, incremental=True, normalization=None):
+        """
+        Convert raw DICOMs to PNG slices.
+        With incremental=True only files that are new or changed since the
+        last run (per the source manifest) are converted. Each DB batch
+        commits slices and manifest together, so an interrupted run resumes
+        where it stopped. incremental=False reconverts everything.
+        normalization is "slice" or "volume" (see apply_window_volume).
+        """
+        # One walk + header pass for new files; the index then drives the plan
+        self.index.refresh(workers=workers, chunk_size=chunk_size, batch_size=batch_size)
+        self.adopt_legacy(refresh=False, workers=workers, chunk_size=chunk_size, batch_size=batch_size)
+        return self._process(self.index.instances(), workers, chunk_size, batch_size, incremental, normalization)
+
+    def _process(self, instances, workers, chunk_size, batch_size, incremental, normalization=None):
+        normalization = normalization or NORMALIZATION_MODE
+        workers = workers or PROCESSING_WORKERS
+        chunk_size = chunk_size or PROCESSING_CHUNK_SIZE
+        batch_size = batch_size or DB_BATCH_SIZE
+
+        session = self.store.Session()
+        tasks, entries, skipped = self.plan(instances, session, incremental=incremental, normalization=normalization)
+        logger.info(
+            f"Converting {len(tasks)} files ({skipped} unchanged skipped) "
+            f"with {workers} worker(s), chunk size {chunk_size}, "
+            f"{normalization} normalization, {self.backend} output"
+        )
+
+        since = time.time()
+        count = 0
+        saved = 0
+        bytes_in = 0
+        bytes_out = 0
+        pending_rows = []
+        pending_entries = []
+
+        try:
+            results = self._convert_all(tasks, workers, chunk_size, normalization)
+            for entry, result in zip(entries, results):
+                count += 1
+                if count % 50 == 0:
+                    logger.info(f"Processing image {count}...")
+
+                if result is None:
+                    # Not recorded in the manifest, so it is retried next run
+                    continue
+
+                bytes_in += result.pop("bytes_in")
+                bytes_out += result.pop("bytes_out")
+                entry["content_hash"] = result.pop("content_hash")
+                entry["output_key"] = result["graphic_id"]
+                pending_rows.append(result)
+                pending_entries.append(entry)
+                saved += 1
+
+                # DB records are written from the parent only, in bulk
+                if len(pending_rows) >= batch_size:
+                    self._flush(session, pending_rows, pending_entries)
+                    pending_rows = []
+                    pending_entries = []
+
+            if pending_rows:
+                self._flush(session, pending_rows, pending_entries)
+        finally:
+            session.close()
+
+        incr("dicom_files_converted", saved)
+        incr("dicom_files_failed", count - saved)
+        incr("dicom_files_skipped", skipped)
+        incr("dicom_bytes_read", bytes_in)
+        incr("processed_bytes_written", bytes_out)
+
+        elapsed = max(time.time() - since, 1e-6)
+        logger.info(f"Total processed: {count} ({saved} saved, {skipped} skipped)")
+        logger.info(
+            f"Throughput: {count / elapsed:.1f} files/s, "
+            f"{bytes_in / elapsed / 1e6:.1f} MB/s read, "
+            f"{bytes_out / elapsed / 1e6:.1f} MB/s written "
+            f"in {elapsed:.1f}s"
+        )
+        return saved
 
 if __name__ == "__main__":
-    proc = DicomProcessor()
-    proc.run()
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert raw DICOMs to PNG slices")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and reconvert everything")
+    parser.add_argument("--patients", nargs="+", help="Only reprocess these PatientIDs")
+    parser.add_argument("--normalization", choices=["slice", "volume"], default=None)
+    parser.add_argument("--backend", choices=["png", "npy"], default=None)
+    args = parser.parse_args()
+
+    proc = DicomProcessor(backend=args.backend)
+    if args.patients:
+        proc.process_patients(args.patients, workers=args.workers, normalization=args.normalization)
+    else:
+        proc.run(workers=args.workers, incremental=not args.full, normalization=args.normalization)
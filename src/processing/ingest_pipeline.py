@@ -0,0 +1,307 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from src.config import PROCESSING_WORKERS, NORMALIZATION_MODE, INGEST_QUEUE_SIZE
+from src.collector.metadata_store import MetadataStore
+from src.collector.download_manager import DownloadManager
+from src.processing.dicom_processor import DicomProcessor
+from src.processing.label_modalities import ModalityLabeler
+from src.processing.create_splits import assign_patients
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Labels the training set is built from; the first one through the pipeline is "trainable"
+TRAINABLE_LABELS = {"T1", "T2", "FLAIR"}
+
+_DONE = object()
+
+
+class Stage:
+    """
+    A pool of worker threads reading a bounded inbox. func(item) returns the
+    items to pass on to the next stage. Blocking on a full downstream queue
+    is how backpressure propagates, and is measured as blocked time.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size or INGEST_QUEUE_SIZE)
+        self.next = None
+        self._threads = []
+        self._lock = threading.Lock()
+
+        # Metrics (seconds summed over workers)
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.starved = 0.0 # Waiting on an empty inbox
+        self.blocked = 0.0 # Waiting on a full downstream queue
+        self.max_depth = 0
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def put(self, item):
+        """Enqueue from outside the pipeline; returns seconds spent blocked."""
+        since = time.perf_counter()
+        self.inbox.put(item)
+        return time.perf_counter() - since
+
+    def close(self):
+        """Drain the inbox and stop the workers."""
+        for _ in self._threads:
+            self.inbox.put(_DONE)
+        for t in self._threads:
+            t.join()
+
+    def _work(self):
+        while True:
+            t0 = time.perf_counter()
+            item = self.inbox.get()
+            t1 = time.perf_counter()
+            if item is _DONE:
+                break
+            depth = self.inbox.qsize() + 1
+
+            failed = False
+            try:
+                outputs = self.func(item) or []
+            except Exception as e:
+                logger.error(f"[{self.name}] {e}")
+                outputs = []
+                failed = True
+            t2 = time.perf_counter()
+
+            if self.next is not None:
+                for out in outputs:
+                    self.next.inbox.put(out)
+            t3 = time.perf_counter()
+
+            with self._lock:
+                self.processed += 1
+                self.failed += failed
+                self.starved += t1 - t0
+                self.busy += t2 - t1
+                self.blocked += t3 - t2
+                self.max_depth = max(self.max_depth, depth)
+
+
+class IngestPipeline:
+    """
+    Streaming ingest: download -> index + convert -> label -> split, as
+    overlapping stages connected by bounded queues. A series is converted
+    as soon as it lands and labeled as soon as it is stored, so the first
+    slices are trainable long before the whole cohort is downloaded.
+
+    Conversion runs in one shared process pool (PROCESSING_WORKERS), fed by
+    convert_threads so a series can be planned and flushed to the DB while
+    the next one is being decoded. DB writes are serialized with a lock.
+    """
+
+    def __init__(self, collection="UPENN-GBM", download=True, convert_threads=2, label_threads=1,
+                 queue_size=None, workers=None, normalization=None, backend=None,
+                 splits_path="data/splits.json"):
+        self.store = MetadataStore()
+        self.processor = DicomProcessor(backend=backend)
+        self.index = self.processor.index
+        self.labeler = ModalityLabeler()
+        self.manager = DownloadManager(collection=collection, store=self.store) if download else None
+        self.workers = workers or PROCESSING_WORKERS
+        self.normalization = normalization or NORMALIZATION_MODE
+        self.splits_path = splits_path
+        self._db_lock = threading.Lock()
+        self._executor = None
+
+        self.convert = Stage("convert", self._convert_root, convert_threads, queue_size)
+        self.label = Stage("label", self._label_series, label_threads, queue_size)
+        self.split = Stage("split", self._assign_split, 1, queue_size)
+        self.convert.next = self.label
+        self.label.next = self.split
+        self.stages = [self.convert, self.label, self.split]
+
+        self.source_blocked = 0.0
+        self.sourced = 0
+        self.slices = 0
+        self.first_trainable = None
+        self._since = None
+
+    def _convert_root(self, root):
+        """Index one landed directory, convert its changed files, emit its series."""
+        with self._db_lock:
+            self.index.refresh(workers=1, roots=[root])
+            instances = self.index.instances(root=root)
+            session = self.store.Session()
+            try:
+                tasks, entries, skipped = self.processor.plan(
+                    instances, session, incremental=True, normalization=self.normalization
+                )
+            finally:
+                session.close()
+
+        results = self.processor._convert_all(
+            tasks, self.workers, 1, self.normalization, executor=self._executor
+        )
+        rows = []
+        done = []
+        for entry, result in zip(entries, results):
+            if result is None:
+                continue
+            result.pop("bytes_in")
+            result.pop("bytes_out")
+            entry["content_hash"] = result.pop("content_hash")
+            entry["output_key"] = result["graphic_id"]
+            rows.append(result)
+            done.append(entry)
+
+        if rows:
+            with self._db_lock:
+                session = self.store.Session()
+                try:
+                    self.processor._flush(session, rows, done)
+                finally:
+                    session.close()
+                self.slices += len(rows)
+
+        series = {}
+        for inst in instances:
+            series.setdefault(inst.series_uid, inst.patient_id)
+        return [(uid, pid) for uid, pid in series.items()]
+
+    def _label_series(self, item):
+        series_uid, patient_id = item
+        with self._db_lock:
+            labels = self.labeler.label_series([series_uid])
+        return [(series_uid, patient_id, labels.get(series_uid))]
+
+    def _assign_split(self, item):
+        series_uid, patient_id, label = item
+        assign_patients([patient_id], path=self.splits_path)
+        if self.first_trainable is None and label in TRAINABLE_LABELS:
+            self.first_trainable = time.perf_counter() - self._since
+            logger.info(f"First trainable series {series_uid} ({label}) after {self.first_trainable:.1f}s")
+
+    def _feed(self, root):
+        self.source_blocked += self.convert.put(root)
+        self.sourced += 1
+
+    def local_roots(self):
+        """Top-level directories of the raw tree (one per downloaded series)."""
+        raw_dir = self.index.raw_dir
+        if not os.path.isdir(raw_dir):
+            return []
+        return sorted(
+            d for d in os.listdir(raw_dir)
+            if not d.startswith(".") and os.path.isdir(os.path.join(raw_dir, d))
+        )
+
+    def run(self, num_patients=None, patient_ids=None, modality="MR"):
+        """
+        Download (or, without a download manager, walk the local raw tree)
+        and push every landed series through the stages. Returns the metrics.
+        """
+        self._since = time.perf_counter()
+        self.processor.adopt_legacy()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # Start every worker now, while this is the only thread: the pool
+            # forks them all on its first submit, and forking once the stage /
+            # download threads run can copy a lock they hold into the child
+            executor.submit(int).result()
+            self._executor = executor
+            for stage in self.stages:
+                stage.start()
+            try:
+                if self.manager is not None:
+                    raw_dir = self.index.raw_dir
+                    self.manager.download_cohort(
+                        num_patients=num_patients, patient_ids=patient_ids, modality=modality,
+                        on_series=lambda row: self._feed(os.path.relpath(
+                            os.path.join(self.manager.raw_dir, row["series_uid"]), raw_dir
+                        )),
+                        # Downloads run ahead of conversion by at most one full inbox
+                        max_in_flight=self.manager.max_workers + self.convert.inbox.maxsize
+                    )
+                else:
+                    for root in self.local_roots():
+                        self._feed(root)
+            finally:
+                # Stages drain in order, so nothing is dropped on shutdown
+                for stage in self.stages:
+                    stage.close()
+                self._executor = None
+
+        metrics = self.metrics()
+        self.report(metrics)
+        return metrics
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self._since if self._since else 0.0
+        return {
+            "elapsed_s": elapsed,
+            "series_in": self.sourced,
+            "slices": self.slices,
+            "first_trainable_s": self.first_trainable,
+            "source_blocked_s": self.source_blocked,
+            "stages": {
+                s.name: {
+                    "workers": s.workers,
+                    "processed": s.processed,
+                    "failed": s.failed,
+                    "busy_s": s.busy,
+                    "starved_s": s.starved,
+                    "blocked_s": s.blocked,
+                    "max_queue_depth": s.max_depth,
+                    "utilization": s.busy / (elapsed * s.workers) if elapsed else 0.0,
+                }
+                for s in self.stages
+            },
+        }
+
+    @staticmethod
+    def report(metrics):
+        first = metrics["first_trainable_s"]
+        logger.info(
+            f"Ingested {metrics['series_in']} series / {metrics['slices']} slices in {metrics['elapsed_s']:.1f}s, "
+            f"first trainable slice after {f'{first:.1f}s' if first is not None else 'n/a'}, "
+            f"source blocked {metrics['source_blocked_s']:.1f}s"
+        )
+        for name, m in metrics["stages"].items():
+            # High blocked = downstream is the bottleneck, high starved = upstream is
+            logger.info(
+                f"  {name:<8} x{m['workers']}: {m['processed']} items ({m['failed']} failed), "
+                f"busy {m['busy_s']:.1f}s ({m['utilization']:.0%}), starved {m['starved_s']:.1f}s, "
+                f"blocked {m['blocked_s']:.1f}s, max queue {m['max_queue_depth']}"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Streaming download -> convert -> label -> split pipeline")
+    parser.add_argument("--num-patients", type=int, default=None)
+    parser.add_argument("--patients", nargs="+", default=None)
+    parser.add_argument("--collection", default="UPENN-GBM")
+    parser.add_argument("--local", action="store_true", help="Skip downloading, ingest the existing raw tree")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--convert-threads", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=None)
+    parser.add_argument("--normalization", choices=["slice", "volume"], default=None)
+    parser.add_argument("--backend", choices=["png", "npy"], default=None)
+    args = parser.parse_args()
+
+    IngestPipeline(
+        collection=args.collection,
+        download=not args.local,
+        convert_threads=args.convert_threads,
+        queue_size=args.queue_size,
+        workers=args.workers,
+        normalization=args.normalization,
+        backend=args.backend,
+    ).run(num_patients=args.num_patients, patient_ids=args.patients)
@@ -1,8 +1,7 @@
-import os
-import pydicom
 import logging
+from sqlalchemy import bindparam
 from src.collector.metadata_store import MetadataStore, ImageMetadata
-from src.config import LOCAL_DATA_DIR
+from src.processing.series_index import SeriesIndex
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,6 +9,7 @@ logger = logging.getLogger(__name__)
 class ModalityLabeler:
     def __init__(self):
         self.store = MetadataStore()
+        self.index = SeriesIndex(store=self.store)
         # Heuristics
         self.rules = {
             "T1": ["t1", "T1"],
@@ -43,54 +43,93 @@ class ModalityLabeler:
             
         return "Other"
 
+    def backfill_series_uids(self, session, series_map):
+        """
+        Rows ingested before series_uid existed only carry a 5-char UID
+        suffix in graphic_id. Resolve it through a suffix -> full UID hash
+        index; ambiguous suffixes are left alone rather than guessed.
+        """
+        suffix_index = {}
+        for uid in series_map:
+            suffix_index.setdefault(uid[-5:], []).append(uid)
+
+        legacy = session.query(ImageMetadata.id, ImageMetadata.graphic_id).filter(
+            ImageMetadata.series_uid.is_(None)
+        ).all()
+
+        updates = []
+        ambiguous = 0
+        for row_id, graphic_id in legacy:
+            # Format: {pid}_{series_uid_suffix}_{n}.png
+            parts = graphic_id.split('_')
+            if len(parts) < 3:
+                continue
+            matches = suffix_index.get(parts[1], [])
+            if len(matches) == 1:
+                updates.append({"id": row_id, "series_uid": matches[0]})
+            elif len(matches) > 1:
+                ambiguous += 1
+
+        if updates:
+            session.bulk_update_mappings(ImageMetadata, updates)
+            session.commit()
+        if ambiguous:
+            logger.warning(f"{ambiguous} legacy records have ambiguous series suffixes, skipped")
+        logger.info(f"Backfilled series_uid on {len(updates)} legacy records")
+
     def run(self):
         session = self.store.Session()
-        records = session.query(ImageMetadata).all()
         
-        logger.info(f"Labeling {len(records)} records...")
-        
-        # Build map from raw files
-        raw_dir = os.path.join(LOCAL_DATA_DIR, "dicom")
-        series_map = {} 
+        # Series descriptions come from the shared header index, no tree walk
+        self.index.ensure()
+        series_map = {
+            uid: self.infer_modality(desc)
+            for uid, desc in self.index.series_descriptions().items()
+        }
         
-        logger.info("Scanning raw data...")
-        for root, dirs, files in os.walk(raw_dir):
-            for file in files:
-                if file.endswith(".dcm"):
-                    try:
-                        ds = pydicom.dcmread(os.path.join(root, file), stop_before_pixels=True)
-                        uid = getattr(ds, 'SeriesInstanceUID', None)
-                        desc = getattr(ds, 'SeriesDescription', '')
-                        
-                        if uid and uid not in series_map:
-                            label = self.infer_modality(desc)
-                            series_map[uid] = label
-                    except:
-                        pass
-                        
         logger.info(f"Found {len(series_map)} unique series")
         
-        # Update DB
-        updated = 0
-        for r in records:
-            # Format: {pid}_{series_uid_suffix}_{count}.png
-            # Match by UID suffix
-            short_uid = r.graphic_id.split('_')[1]
-            
-            found_label = "Unknown"
-            for full_uid, label in series_map.items():
-                if full_uid.endswith(short_uid):
-                    found_label = label
-                    break
-            
-            if found_label != "Unknown":
-                r.modality = found_label
-                updated += 1
+        self.backfill_series_uids(session, series_map)
+        updated, labeled = self.apply_labels(session, series_map)
                 
         session.commit()
-        logger.info(f"Updated {updated} records")
+        logger.info(f"Updated {updated} records across {labeled} series")
         session.close()
 
+    def apply_labels(self, session, series_map):
+        """
+        One UPDATE ... WHERE series_uid = ? per series, run as executemany.
+        Returns (rows updated, series labeled). The caller commits.
+        """
+        params = [
+            {"b_uid": uid, "b_label": label}
+            for uid, label in series_map.items()
+            if label != "Unknown"
+        ]
+        updated = 0
+        if params:
+            table = ImageMetadata.__table__
+            stmt = table.update().where(
+                table.c.series_uid == bindparam("b_uid")
+            ).values(modality=bindparam("b_label"))
+            result = session.execute(stmt, params)
+            updated = max(result.rowcount, 0)
+        return updated, len(params)
+
+    def label_series(self, series_uids):
+        """Label just these series (e.g. as they come out of the ingest pipeline)."""
+        series_map = {
+            uid: self.infer_modality(desc)
+            for uid, desc in self.index.series_descriptions(series_uids).items()
+        }
+        session = self.store.Session()
+        try:
+            self.apply_labels(session, series_map)
+            session.commit()
+        finally:
+            session.close()
+        return series_map
+
 if __name__ == "__main__":
     lbl = ModalityLabeler()
     lbl.run()
@@ -0,0 +1,238 @@
+import os
+import time
+import logging
+import pydicom
+from multiprocessing import Pool
+from sqlalchemy import or_
+from src.config import LOCAL_DATA_DIR, PROCESSING_WORKERS, PROCESSING_CHUNK_SIZE, DB_BATCH_SIZE
+from src.collector.metadata_store import MetadataStore, DicomInstance
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Only these tags are parsed; pixel data is never touched
+HEADER_TAGS = [
+    "PatientID",
+    "SeriesInstanceUID",
+    "SeriesDescription",
+    "Modality",
+    "InstanceNumber",
+    "ImagePositionPatient",
+    "SliceLocation",
+]
+
+
+def list_dicom_files(raw_dir):
+    """Walk raw_dir and return every .dcm path in walk order (hidden directories are skipped)."""
+    paths = []
+    for root, dirs, files in os.walk(raw_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for file in files:
+            if file.endswith(".dcm"):
+                paths.append(os.path.join(root, file))
+    return paths
+
+
+def read_header(task):
+    """Parse the indexed tags of one file. Module-level for the pool."""
+    rel, path, size, mtime = task
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+    except Exception as e:
+        logger.error(f"Error reading header {path}: {e}")
+        return None
+
+    position = None
+    ipp = getattr(ds, 'ImagePositionPatient', None)
+    if ipp is not None and len(ipp) == 3:
+        position = float(ipp[2])
+    elif getattr(ds, 'SliceLocation', None) is not None:
+        position = float(ds.SliceLocation)
+
+    instance = getattr(ds, 'InstanceNumber', None)
+
+    return {
+        "path": rel,
+        "patient_id": getattr(ds, 'PatientID', 'Unknown'),
+        "series_uid": getattr(ds, 'SeriesInstanceUID', 'Unknown'),
+        "series_description": getattr(ds, 'SeriesDescription', ''),
+        "modality": getattr(ds, 'Modality', None),
+        "instance_number": int(instance) if instance not in (None, '') else None,
+        "slice_position": position,
+        "file_size": size,
+        "mtime": mtime,
+    }
+
+
+class SeriesIndex:
+    """
+    Persistent PatientID / SeriesInstanceUID / instance index of the raw tree.
+    refresh() walks the tree once and only parses headers of new or changed
+    files; everything else (processor, labeler, splitter) queries the table.
+    """
+
+    def __init__(self, store=None, raw_dir=None):
+        self.store = store or MetadataStore()
+        self.raw_dir = raw_dir or os.path.join(LOCAL_DATA_DIR, "dicom")
+
+    def abspath(self, rel_path):
+        return os.path.join(self.raw_dir, rel_path)
+
+    def is_empty(self):
+        session = self.store.Session()
+        try:
+            return session.query(DicomInstance.path).first() is None
+        finally:
+            session.close()
+
+    def refresh(self, workers=None, chunk_size=None, batch_size=None, roots=None):
+        """
+        Bring the index up to date with the tree. roots (directories relative
+        to raw_dir) limits the walk, e.g. to the folders of one patient.
+        """
+        workers = workers or PROCESSING_WORKERS
+        chunk_size = chunk_size or PROCESSING_CHUNK_SIZE
+        batch_size = batch_size or DB_BATCH_SIZE
+        since = time.time()
+
+        session = self.store.Session()
+        try:
+            query = session.query(DicomInstance.path, DicomInstance.file_size, DicomInstance.mtime)
+            if roots is None:
+                paths = list_dicom_files(self.raw_dir)
+            else:
+                roots = [os.path.normpath(r) for r in roots]
+                paths = []
+                for root in roots:
+                    paths.extend(list_dicom_files(self.abspath(root)))
+                # Only rows inside the walked roots (deletions are only detectable there)
+                query = query.filter(or_(*[
+                    DicomInstance.path.startswith(root + os.sep, autoescape=True) for root in roots
+                ]))
+            known = {path: (size, mtime) for path, size, mtime in query.all()}
+
+            tasks = []
+            seen = set()
+            for path in paths:
+                rel = os.path.relpath(path, self.raw_dir)
+                st = os.stat(path)
+                seen.add(rel)
+                if known.get(rel) != (st.st_size, st.st_mtime):
+                    tasks.append((rel, path, st.st_size, st.st_mtime))
+
+            removed = [rel for rel in known if rel not in seen]
+            for i in range(0, len(removed), batch_size):
+                session.query(DicomInstance).filter(
+                    DicomInstance.path.in_(removed[i:i + batch_size])
+                ).delete(synchronize_session=False)
+            session.commit()
+
+            if workers > 1 and len(tasks) > chunk_size:
+                with Pool(processes=workers) as pool:
+                    results = pool.map(read_header, tasks, chunksize=chunk_size)
+            else:
+                results = [read_header(t) for t in tasks]
+
+            rows = [r for r in results if r is not None]
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                session.query(DicomInstance).filter(
+                    DicomInstance.path.in_([r["path"] for r in batch])
+                ).delete(synchronize_session=False)
+                session.bulk_insert_mappings(DicomInstance, batch)
+                session.commit()
+        finally:
+            session.close()
+
+        logger.info(
+            f"Series index: {len(rows)} headers parsed, {len(removed)} removed, "
+            f"{len(seen) - len(tasks)} unchanged in {time.time() - since:.1f}s"
+        )
+
+    def ensure(self):
+        """Build the index on first use."""
+        if self.is_empty():
+            self.refresh()
+
+    def instances(self, patient_ids=None, series_uid=None, root=None):
+        """
+        Instances ordered by patient, series and instance number, optionally
+        limited to files under one directory relative to raw_dir.
+        """
+        session = self.store.Session()
+        try:
+            query = session.query(DicomInstance)
+            if isinstance(patient_ids, str):
+                query = query.filter(DicomInstance.patient_id == patient_ids)
+            elif patient_ids is not None:
+                query = query.filter(DicomInstance.patient_id.in_(patient_ids))
+            if series_uid:
+                query = query.filter(DicomInstance.series_uid == series_uid)
+            if root:
+                query = query.filter(DicomInstance.path.startswith(os.path.normpath(root) + os.sep, autoescape=True))
+            return query.order_by(
+                DicomInstance.patient_id,
+                DicomInstance.series_uid,
+                DicomInstance.instance_number,
+                DicomInstance.path
+            ).all()
+        finally:
+            session.close()
+
+    def unindexed_dirs(self):
+        """
+        Top-level directories of raw_dir without a single indexed file, e.g.
+        series downloaded since the last refresh. One index seek per
+        directory: the first path at or after "<dir>/" tells whether any
+        file of it is indexed (a false "new" only costs an extra walk).
+        """
+        try:
+            names = [e.name for e in os.scandir(self.raw_dir) if e.is_dir() and not e.name.startswith(".")]
+        except FileNotFoundError:
+            return []
+
+        session = self.store.Session()
+        try:
+            new = []
+            for name in sorted(names):
+                prefix = name + os.sep
+                row = session.query(DicomInstance.path).filter(
+                    DicomInstance.path >= prefix
+                ).order_by(DicomInstance.path).first()
+                if row is None or not row[0].startswith(prefix):
+                    new.append(name)
+            return new
+        finally:
+            session.close()
+
+    def patient_dirs(self, patient_id):
+        """Directories (relative to raw_dir) holding this patient's files."""
+        session = self.store.Session()
+        try:
+            rows = session.query(DicomInstance.path).filter(DicomInstance.patient_id == patient_id).all()
+            return sorted({os.path.dirname(r[0]) for r in rows})
+        finally:
+            session.close()
+
+    def series_descriptions(self, series_uids=None):
+        """{series_uid: SeriesDescription} for every indexed series (or just series_uids)."""
+        session = self.store.Session()
+        try:
+            query = session.query(DicomInstance.series_uid, DicomInstance.series_description)
+            if series_uids is not None:
+                query = query.filter(DicomInstance.series_uid.in_(series_uids))
+            rows = query.distinct().all()
+            return {uid: desc for uid, desc in rows}
+        finally:
+            session.close()
+
+    def list_patients(self):
+        session = self.store.Session()
+        try:
+            rows = session.query(DicomInstance.patient_id).distinct().order_by(DicomInstance.patient_id).all()
+            return [r[0] for r in rows]
+        finally:
+            session.close()
+
+if __name__ == "__main__":
+    SeriesIndex().refresh()
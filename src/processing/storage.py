@@ -0,0 +1,355 @@
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.config import (
+    STORAGE_BACKEND, MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_BUCKET_NAME,
+    MINIO_SECURE, STORAGE_PREFIX, STORAGE_MAX_CONNECTIONS, STORAGE_IO_WORKERS,
+    STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES,
+)
+from src.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+# Keys of objects in S3 / MinIO; anything else is a local filesystem path
+S3_SCHEME = "s3://"
+
+# Objects above this size are uploaded / downloaded in parallel parts
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+
+
+def is_remote(key):
+    return key.startswith(S3_SCHEME)
+
+
+def split_s3_key(key):
+    bucket, _, name = key[len(S3_SCHEME):].partition("/")
+    return bucket, name
+
+
+class LocalStorage:
+    """Processed slices as plain files under root. Keys are absolute paths."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, name):
+        return os.path.join(self.root, name)
+
+    def put(self, name, data):
+        path = self.key(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def put_many(self, items):
+        return [self.put(name, data) for name, data in items]
+
+    def exists(self, key):
+        return os.path.exists(key)
+
+    def delete(self, key):
+        if os.path.exists(key):
+            os.remove(key)
+
+
+class S3Storage:
+    """
+    Processed slices in an S3-compatible bucket (MinIO in docker-compose).
+    One boto3 client per process holds a pool of STORAGE_MAX_CONNECTIONS
+    keep-alive connections shared by the I/O threads; large objects (npy
+    volumes) go through the transfer manager as concurrent multipart
+    uploads and ranged downloads. Pass client= to run against moto.
+    """
+
+    def __init__(self, bucket=None, prefix=None, client=None, endpoint=None, io_workers=None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket or MINIO_BUCKET_NAME
+        self.prefix = STORAGE_PREFIX if prefix is None else prefix
+        self.io_workers = io_workers or STORAGE_IO_WORKERS
+        if client is None:
+            endpoint = endpoint or MINIO_ENDPOINT
+            if endpoint and "://" not in endpoint:
+                endpoint = f"{'https' if MINIO_SECURE else 'http'}://{endpoint}"
+            client = boto3.client(
+                "s3",
+                endpoint_url=endpoint or None,
+                aws_access_key_id=MINIO_ACCESS_KEY,
+                aws_secret_access_key=MINIO_SECRET_KEY,
+                config=Config(
+                    max_pool_connections=STORAGE_MAX_CONNECTIONS,
+                    retries={"max_attempts": 5, "mode": "adaptive"},
+                ),
+            )
+        self.client = client
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            max_concurrency=self.io_workers,
+        )
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.io_workers)
+        return self._executor
+
+    def key(self, name):
+        path = f"{self.prefix}/{name}" if self.prefix else name
+        return f"{S3_SCHEME}{self.bucket}/{path}"
+
+    def ensure_bucket(self):
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except Exception:
+            self.client.create_bucket(Bucket=self.bucket)
+
+    def put(self, name, data):
+        key = self.key(name)
+        bucket, obj = split_s3_key(key)
+        self.client.put_object(Bucket=bucket, Key=obj, Body=bytes(data))
+        return key
+
+    def put_many(self, items):
+        """
+        Upload (name, bytes) pairs concurrently over the pooled connections.
+        Returns keys in input order, None where an upload failed.
+        """
+        def put_one(item):
+            try:
+                return self.put(*item)
+            except Exception as e:
+                logger.error(f"Upload failed for {item[0]}: {e}")
+                return None
+        return list(self.executor.map(put_one, items))
+
+    def put_file(self, name, src_path):
+        """Upload a local file, as a multipart upload above the threshold."""
+        key = self.key(name)
+        bucket, obj = split_s3_key(key)
+        self.client.upload_file(src_path, bucket, obj, Config=self.transfer_config)
+        return key
+
+    def get(self, key):
+        bucket, obj = split_s3_key(key)
+        return self.client.get_object(Bucket=bucket, Key=obj)["Body"].read()
+
+    def get_range(self, key, start, end):
+        """Bytes start..end (inclusive) of an object."""
+        bucket, obj = split_s3_key(key)
+        response = self.client.get_object(Bucket=bucket, Key=obj, Range=f"bytes={start}-{end}")
+        return response["Body"].read()
+
+    def download(self, key, dest_path):
+        bucket, obj = split_s3_key(key)
+        self.client.download_file(bucket, obj, dest_path, Config=self.transfer_config)
+
+    def exists(self, key):
+        bucket, obj = split_s3_key(key)
+        try:
+            self.client.head_object(Bucket=bucket, Key=obj)
+            return True
+        except Exception:
+            return False
+
+    def delete(self, key):
+        bucket, obj = split_s3_key(key)
+        self.client.delete_object(Bucket=bucket, Key=obj)
+
+
+class DiskCache:
+    """
+    Read-through local copy of remote objects, bounded to max_bytes. Files
+    are named by a hash of their key, so every process (DataLoader workers,
+    the app, the predictor) shares one cache directory. Hits refresh the
+    file's mtime and eviction drops the least recently used files first.
+    """
+
+    def __init__(self, remote, cache_dir=None, max_bytes=None):
+        self.remote = remote
+        self.cache_dir = cache_dir or STORAGE_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else STORAGE_CACHE_MAX_BYTES
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        base, ext = os.path.splitext(key)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ext)
+
+    def cached(self, key):
+        return os.path.exists(self.path(key))
+
+    def local_path(self, key):
+        """Local file holding the object, downloaded on a miss."""
+        path = self.path(key)
+        if os.path.exists(path):
+            self.hits += 1
+            count("storage_cache_hits")
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+
+        self.misses += 1
+        count("storage_cache_misses")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self.remote.download(key, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def adopt(self, key, src_path):
+        """Move a freshly written local file into the cache as key's copy."""
+        path = self.path(key)
+        shutil.move(src_path, path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def prefetch(self, keys, workers=None):
+        """
+        Warm the cache for keys in order on background threads, stopping
+        once the cache is full so prefetching never evicts what it fetched.
+        Returns the thread so callers can join it if they want to.
+        """
+        def run():
+            pending = [k for k in dict.fromkeys(keys) if not self.cached(k)]
+            fetched = 0
+            with ThreadPoolExecutor(max_workers=workers or self.remote.io_workers) as pool:
+                for i in range(0, len(pending), 64):
+                    if self.size() >= 0.9 * self.max_bytes:
+                        break
+                    for path in pool.map(self._try_fetch, pending[i:i + 64]):
+                        fetched += path is not None
+            logger.info(f"Prefetched {fetched} of {len(pending)} uncached objects")
+
+        thread = threading.Thread(target=run, name="storage-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def _try_fetch(self, key):
+        try:
+            return self.local_path(key)
+        except Exception as e:
+            logger.error(f"Prefetch failed for {key}: {e}")
+            return None
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(e.stat().st_size for e in os.scandir(self.cache_dir) if e.is_file())
+            return self._size
+
+    def _added(self, nbytes):
+        self.size()
+        with self._lock:
+            self._size += nbytes
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used files until the cache is back under 90% of max_bytes."""
+        with self._lock:
+            entries = [e for e in os.scandir(self.cache_dir) if e.is_file() and not e.name.endswith(".tmp")]
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            total = sum(e.stat().st_size for e in entries)
+            target = 0.9 * self.max_bytes
+            removed = 0
+            for e in entries:
+                if total <= target:
+                    break
+                try:
+                    size = e.stat().st_size
+                    os.remove(e.path)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    pass # Another process got there first
+            self._size = total
+        if removed:
+            logger.info(f"Evicted {removed} cached objects, {total / 1e6:.0f} MB left")
+
+
+_storages = {}
+_remote = {}
+
+
+def get_storage(processed_dir):
+    """Configured writer for processed slices, one per process."""
+    key = (os.getpid(), processed_dir)
+    storage = _storages.get(key)
+    if storage is None:
+        if STORAGE_BACKEND != "s3":
+            storage = LocalStorage(processed_dir)
+        else:
+            storage = S3Storage()
+            storage.ensure_bucket()
+        _storages[key] = storage
+    return storage
+
+
+def remote_cache():
+    """The per-process S3 client behind its shared disk cache."""
+    pid = os.getpid()
+    cache = _remote.get(pid)
+    if cache is None:
+        cache = DiskCache(S3Storage())
+        _remote[pid] = cache
+    return cache
+
+
+def local_path(key):
+    """A readable local path for any slice key (remote objects go through the disk cache)."""
+    if is_remote(key):
+        return remote_cache().local_path(key)
+    return key
+
+
+def name_of(key, processed_dir):
+    """
+    Key relative to the processed-slice storage (tensor-store keys keep
+    their #offset): what the inference server accepts instead of paths.
+    """
+    root = get_storage(processed_dir).key("")
+    return key[len(root):] if key.startswith(root) else key
+
+
+def exists(key):
+    if is_remote(key):
+        cache = remote_cache()
+        return cache.cached(key) or cache.remote.exists(key)
+    return os.path.exists(key)
+
+
+def delete(key):
+    """Remove a slice object wherever its key points (and its cached copy)."""
+    if is_remote(key):
+        cache = remote_cache()
+        cache.remote.delete(key)
+        if cache.cached(key):
+            os.remove(cache.path(key))
+    elif os.path.exists(key):
+        os.remove(key)
+
+
+def prefetch(keys):
+    """Start warming the disk cache for the remote keys among keys (None if there are none)."""
+    remote = [k for k in keys if is_remote(k)]
+    if not remote:
+        return None
+    return remote_cache().prefetch(remote)
@@ -0,0 +1,178 @@
+import os
+import io
+import logging
+import numpy as np
+import cv2
+from src.processing import storage
+
+logger = logging.getLogger(__name__)
+
+# Slices in the tensor store are addressed as "<series file>.npy#<offset>"
+KEY_SEPARATOR = "#"
+
+# Bytes fetched to parse a remote .npy header (np.save writes 128 for our shapes)
+NPY_HEADER_PROBE = 4096
+
+
+def is_tensor_key(key):
+    return KEY_SEPARATOR in key and key.split(KEY_SEPARATOR, 1)[0].endswith(".npy")
+
+
+def split_key(key):
+    path, offset = key.rsplit(KEY_SEPARATOR, 1)
+    return path, int(offset)
+
+
+def tier_key(key, size):
+    """
+    Key of the size x size copy of a slice: same store, with a t<size>
+    directory in front of the file name. Works for PNG paths, object keys
+    and tensor-store keys (the offset is kept).
+    """
+    offset = None
+    if is_tensor_key(key):
+        key, offset = split_key(key)
+    sep = "/" if storage.is_remote(key) else os.sep
+    head, _, name = key.rpartition(sep)
+    derived = sep.join([head, f"t{size}", name]) if head else f"t{size}{sep}{name}"
+    return TensorStore.key(derived, offset) if offset is not None else derived
+
+
+def parse_tiers(tiers):
+    return sorted(int(t) for t in tiers.split(",") if t) if tiers else []
+
+
+def pick_tier(key, tiers, size):
+    """Smallest stored tier of at least size pixels, else the original slice."""
+    for t in parse_tiers(tiers):
+        if t >= size:
+            return tier_key(key, t)
+    return key
+
+
+class TensorStore:
+    """
+    Contiguous per-series uint8 volumes (slices, h, w) saved as .npy under
+    <processed_dir>/volumes. Readers memory-map each file once and hand out
+    zero-copy slice views, so there is no per-sample open or decode.
+    With object storage the volume is uploaded to the bucket and readers
+    map the copy in the local disk cache. A single slice of a volume that
+    is not cached yet is fetched with a ranged GET instead of downloading
+    the whole series.
+    """
+
+    def __init__(self, processed_dir):
+        self.volume_dir = os.path.join(processed_dir, "volumes")
+        self._open = {}
+        self._headers = {} # Remote volume -> (shape, dtype, data offset)
+
+    def write_series(self, name, volume, tier=None):
+        """
+        Write a whole series atomically and return its path (or object key).
+        tier writes a pre-resized copy under volumes/t<tier>, see tier_key.
+        """
+        subdir = f"t{tier}" if tier else ""
+        volume_dir = os.path.join(self.volume_dir, subdir) if subdir else self.volume_dir
+        os.makedirs(volume_dir, exist_ok=True)
+        path = os.path.join(volume_dir, f"{name}.npy")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(volume, dtype=np.uint8))
+
+        writer = storage.get_storage(os.path.dirname(self.volume_dir))
+        if isinstance(writer, storage.S3Storage):
+            try:
+                key = writer.put_file("/".join(filter(None, ["volumes", subdir, f"{name}.npy"])), tmp_path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            # Just written, so keep it as the cached copy instead of re-downloading
+            storage.remote_cache().adopt(key, tmp_path)
+            return key
+
+        # Readers holding a map of the old file keep a valid inode
+        os.replace(tmp_path, path)
+        return path
+
+    def delete_series(self, path, tiers=None):
+        """Remove a series volume and its tier copies, e.g. once no catalog row points at it."""
+        for key in [path] + [tier_key(path, size) for size in parse_tiers(tiers)]:
+            self._open.pop(key, None)
+            self._headers.pop(key, None)
+            storage.delete(key)
+
+    @staticmethod
+    def key(path, offset):
+        return f"{path}{KEY_SEPARATOR}{offset}"
+
+    def volume(self, path):
+        vol = self._open.get(path)
+        if vol is None:
+            vol = np.load(storage.local_path(path), mmap_mode="r")
+            self._open[path] = vol
+        return vol
+
+    def read(self, key):
+        """Read-only (h, w) view into the mapped series file."""
+        path, offset = split_key(key)
+        if path not in self._open and storage.is_remote(path) and not storage.remote_cache().cached(path):
+            image = self._read_range(path, offset)
+            if image is not None:
+                return image
+        return self.volume(path)[offset]
+
+    def _header(self, path):
+        header = self._headers.get(path)
+        if header is None:
+            f = io.BytesIO(storage.remote_cache().remote.get_range(path, 0, NPY_HEADER_PROBE - 1))
+            version = np.lib.format.read_magic(f)
+            read_header = {
+                (1, 0): np.lib.format.read_array_header_1_0,
+                (2, 0): np.lib.format.read_array_header_2_0,
+            }[version]
+            shape, fortran_order, dtype = read_header(f)
+            if fortran_order:
+                raise ValueError("Fortran-ordered volume")
+            header = (shape, dtype, f.tell())
+            self._headers[path] = header
+        return header
+
+    def _read_range(self, path, offset):
+        """One slice of a remote volume by byte range; None to fall back to the whole file."""
+        try:
+            shape, dtype, data_offset = self._header(path)
+            if not 0 <= offset < shape[0]:
+                raise IndexError(f"Slice {offset} out of range for {path}")
+            slice_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+            start = data_offset + offset * slice_bytes
+            data = storage.remote_cache().remote.get_range(path, start, start + slice_bytes - 1)
+            return np.frombuffer(data, dtype=dtype).reshape(shape[1:])
+        except IndexError:
+            raise
+        except Exception as e:
+            logger.warning(f"Range read of {path} failed ({e}), fetching the whole volume")
+            return None
+
+    def __getstate__(self):
+        # Maps are per process; DataLoader workers reopen lazily
+        state = self.__dict__.copy()
+        state["_open"] = {}
+        state["_headers"] = {}
+        return state
+
+
+_default_store = TensorStore("")
+
+
+def slice_exists(key):
+    if is_tensor_key(key):
+        return storage.exists(split_key(key)[0])
+    return storage.exists(key)
+
+
+def load_slice(key):
+    """Grayscale uint8 array for a PNG path, object key or tensor-store key."""
+    if is_tensor_key(key):
+        return _default_store.read(key)
+    stream = np.fromfile(storage.local_path(key), np.uint8)
+    return cv2.imdecode(stream, cv2.IMREAD_GRAYSCALE)
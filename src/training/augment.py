@@ -0,0 +1,71 @@
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from src.training.model import GRAY_MEAN, GRAY_STD, IMAGENET_MEAN, IMAGENET_STD
+
+
+def to_float(batch):
+    """(B, H, W) or (B, 1, H, W) uint8 batch -> (B, 1, H, W) float in [0, 1]."""
+    if batch.dim() == 3:
+        batch = batch.unsqueeze(1)
+    return batch.float().div_(255.0)
+
+
+class BatchTransform(nn.Module):
+    """
+    Deterministic batch preprocessing (validation / evaluation): scale the
+    collated uint8 batch to [0, 1] and normalize it for an in_channels
+    model, the batched equivalent of ToTensor + normalize(in_channels).
+    """
+
+    def __init__(self, in_channels=1):
+        super().__init__()
+        self.in_channels = in_channels
+        mean, std = (GRAY_MEAN, GRAY_STD) if in_channels == 1 else (IMAGENET_MEAN, IMAGENET_STD)
+        self.register_buffer("mean", torch.tensor(mean).view(1, -1, 1, 1))
+        self.register_buffer("std", torch.tensor(std).view(1, -1, 1, 1))
+
+    def normalize(self, x):
+        if self.in_channels == 3:
+            x = x.expand(-1, 3, -1, -1)
+        return (x - self.mean) / self.std
+
+    def forward(self, batch):
+        return self.normalize(to_float(batch))
+
+
+class BatchAugment(BatchTransform):
+    """
+    Training augmentation on a whole batch: random horizontal flip and
+    rotation in [-degrees, degrees] per sample, folded into one affine grid
+    and applied with a single grid_sample, then normalization. Replaces the
+    per-sample RandomHorizontalFlip + RandomRotation PIL pipeline; slices
+    are square after preprocessing, so normalized grid coordinates rotate
+    without shear.
+    """
+
+    def __init__(self, in_channels=1, flip_p=0.5, degrees=10.0, generator=None):
+        super().__init__(in_channels)
+        self.flip_p = flip_p
+        self.degrees = degrees
+        self.generator = generator
+
+    def forward(self, batch):
+        x = to_float(batch)
+        n = x.shape[0]
+
+        rand = torch.rand(n, 2, generator=self.generator).to(x.device)
+        angle = (rand[:, 0] * 2 - 1) * math.radians(self.degrees)
+        flip = torch.where(rand[:, 1] < self.flip_p, -1.0, 1.0)
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        zero = torch.zeros_like(cos)
+
+        # Output -> input sampling grid: rotate, then mirror x
+        theta = torch.stack([
+            torch.stack([flip * cos, -flip * sin, zero], dim=1),
+            torch.stack([sin, cos, zero], dim=1),
+        ], dim=1)
+        grid = F.affine_grid(theta, x.shape, align_corners=False)
+        x = F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+        return self.normalize(x)
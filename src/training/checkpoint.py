@@ -0,0 +1,168 @@
+import os
+import json
+import glob
+import queue
+import random
+import shutil
+import logging
+import threading
+import numpy as np
+import torch
+from src.config import MODEL_VERSIONS_DIR
+
+logger = logging.getLogger(__name__)
+
+# Inside a version directory
+CHECKPOINT_FILE = "checkpoint.pt" # Full training state of the last finished epoch
+MODEL_FILE = "model.pth" # Best weights, a bare state dict ModelPredictor loads
+META_FILE = "meta.json"
+
+
+def to_cpu(obj):
+    """Detached CPU copy of every tensor in a (nested) state dict."""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    tmp_path = f"{path}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def atomic_json(data, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter:
+    """
+    Serializes checkpoints on a background thread. The training loop only
+    pays for the CPU copy of the state (to_cpu), which it must take anyway
+    since the weights keep changing; pickling and the disk write overlap
+    with the next epoch. At most max_pending saves queue up before save()
+    blocks, which bounds the memory held by snapshots.
+    """
+
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args):
+        self.queue.put((func, args))
+
+    def save(self, state, path):
+        self.submit(atomic_save, state, path)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                func, args = job
+                func(*args)
+            except Exception as e:
+                logger.error(f"Checkpoint write failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def wait(self):
+        """Block until everything submitted so far is on disk."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def capture(model, optimizer, epoch, progress):
+    """Everything needed to continue after epoch: weights, optimizer, RNG and loop progress."""
+    return {
+        "model": to_cpu(model.state_dict()),
+        "optimizer": to_cpu(optimizer.state_dict()),
+        "epoch": epoch,
+        "rng": rng_state(),
+        **progress,
+    }
+
+
+def restore(path, model, optimizer):
+    """Load a checkpoint written by capture() into model and optimizer; returns the checkpoint."""
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    set_rng_state(state["rng"])
+    logger.info(f"Resumed from {path} after epoch {state['epoch']}")
+    return state
+
+
+# Versioned artifacts: <MODEL_VERSIONS_DIR>/<tag>/{checkpoint.pt, model.pth, meta.json}
+
+def version_dir(tag, root=None):
+    return os.path.join(root or MODEL_VERSIONS_DIR, tag)
+
+
+def list_versions(root=None):
+    """Version tags with a model, oldest first."""
+    paths = glob.glob(os.path.join(root or MODEL_VERSIONS_DIR, "*", MODEL_FILE))
+    paths.sort(key=os.path.getmtime)
+    return [os.path.basename(os.path.dirname(p)) for p in paths]
+
+
+def latest_checkpoint(root=None):
+    """Most recently written training checkpoint across versions, or None."""
+    paths = glob.glob(os.path.join(root or MODEL_VERSIONS_DIR, "*", CHECKPOINT_FILE))
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def resolve_model(name, root=None):
+    """
+    Model file for name: an existing path, a version tag, or "latest"
+    (the most recently trained version). Unknown names come back as-is,
+    so the caller reports the missing file.
+    """
+    if not name or os.path.isfile(name):
+        return name
+    if name == "latest":
+        versions = list_versions(root)
+        if not versions:
+            return name
+        name = versions[-1]
+    path = os.path.join(version_dir(name, root), MODEL_FILE)
+    return path if os.path.isfile(path) else name
+
+
+def publish(src_path, dest_path):
+    """Copy a version's model to a fixed path (e.g. the default artifact), atomically."""
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    tmp_path = f"{dest_path}.tmp"
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dest_path)
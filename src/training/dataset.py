@@ -2,18 +2,66 @@ import torch
 from torch.utils.data import Dataset
 import cv2
 import numpy as np
-from src.collector.metadata_store import MetadataStore, ImageMetadata
-from sqlalchemy.orm import sessionmaker
+from src.collector.metadata_store import MetadataStore
+from src.processing.tensor_store import TensorStore, is_tensor_key, split_key, pick_tier
+from src.processing import storage
+from src.instrumentation import timed
 import logging
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class DecodedSliceCache:
+    """
+    Every slice of a dataset decoded once into a single shared-memory uint8
+    buffer (plus offsets and shapes). DataLoader workers get the same pages,
+    forked or spawned, so epochs after the first never touch disk or the
+    PNG decoder. Decoding runs on a thread pool; cv2 releases the GIL.
+    """
+
+    def __init__(self, keys, load, workers=None):
+        since = time.time()
+        workers = workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            images = list(pool.map(lambda key: np.ascontiguousarray(load(key)), keys))
+
+        sizes = [img.size for img in images]
+        self.offsets = torch.zeros(len(images) + 1, dtype=torch.int64)
+        self.offsets[1:] = torch.tensor(sizes, dtype=torch.int64).cumsum(0)
+        self.shapes = torch.tensor([img.shape for img in images], dtype=torch.int32)
+        self.buffer = torch.empty(int(self.offsets[-1]), dtype=torch.uint8)
+
+        buf = self.buffer.numpy()
+        for i, img in enumerate(images):
+            buf[self.offsets[i]:self.offsets[i + 1]] = img.ravel()
+            images[i] = None
+
+        for t in (self.buffer, self.offsets, self.shapes):
+            t.share_memory_()
+        logger.info(
+            f"Cached {len(keys)} decoded slices ({self.buffer.numel() / 1e6:.0f} MB) "
+            f"in {time.time() - since:.1f}s"
+        )
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, idx):
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        h, w = self.shapes[idx].tolist()
+        return self.buffer[start:end].numpy().reshape(h, w)
+
+
 class NeuroSiftDataset(Dataset):
-    def __init__(self, split="train", transform=None, target_classes=["T1", "T2", "FLAIR"]):
+    def __init__(self, split="train", transform=None, target_classes=["T1", "T2", "FLAIR"], cache=False, cache_workers=None,
+                 image_size=None):
         self.transform = transform
+        self.image_size = image_size # Resize once on load (and so once per slice with the cache)
+        self.tensor_store = TensorStore("") # Keys are absolute, nothing is written
         self.classes = target_classes
         self.class_to_idx = {cls: idx for idx, cls in enumerate(self.classes)}
         
@@ -24,45 +72,70 @@ class NeuroSiftDataset(Dataset):
         target_patients = splits.get(split, [])
         logger.info(f"Init {split} set with {len(target_patients)} patients")
 
-        # DB connection
+        # Filter records (indexed on pmc_id + modality)
         store = MetadataStore()
-        Session = sessionmaker(bind=store.engine)
-        session = Session()
-        
-        # Filter records
-        self.records = session.query(ImageMetadata).filter(
-            ImageMetadata.modality.in_(self.classes),
-            ImageMetadata.pmc_id.in_(target_patients)
-        ).all()
-        
-        session.close()
+        self.records = store.get_slices(
+            patient_ids=target_patients,
+            modalities=self.classes,
+            ordered=False
+        )
         
         # Build index
         self.data_index = []
         for r in self.records:
             self.data_index.append({
-                "path": r.s3_key,
+                # Smallest pre-resized tier that still covers image_size
+                "path": pick_tier(r.s3_key, r.tiers, image_size) if image_size else r.s3_key,
                 "label": r.modality
             })
             
         logger.info(f"Loaded {len(self.data_index)} images")
 
+        # Slices in object storage: start filling the shared disk cache in the background
+        storage.prefetch([
+            split_key(item["path"])[0] if is_tensor_key(item["path"]) else item["path"]
+            for item in self.data_index
+        ])
+
+        # Decoded slices in shared memory, filled once and reused by every epoch and worker
+        self.cache = None
+        if cache and self.data_index:
+            self.cache = DecodedSliceCache(
+                [item["path"] for item in self.data_index], self.load_image, workers=cache_workers
+            )
+
     def __len__(self):
         return len(self.data_index)
 
+    def load_image(self, path):
+        # Slices are single-channel; keep them that way (H, W) uint8
+        if is_tensor_key(path):
+            # Zero-copy view into the memory-mapped series volume
+            image = self.tensor_store.read(path)
+        else:
+            # Binary read for unicode support
+            stream = np.fromfile(storage.local_path(path), np.uint8)
+            image = cv2.imdecode(stream, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                raise FileNotFoundError(f"Bad image: {path}")
+
+        size = self.image_size
+        if size and image.shape != (size, size):
+            # Area averaging when shrinking, like PIL's antialiased Resize
+            interpolation = cv2.INTER_AREA if image.shape[0] > size else cv2.INTER_LINEAR
+            image = cv2.resize(image, (size, size), interpolation=interpolation)
+        return image
+
+    @timed("dataset_getitem")
     def __getitem__(self, idx):
         item = self.data_index[idx]
         path = item["path"]
         label_str = item["label"]
         
-        # Binary read for unicode support
-        stream = np.fromfile(path, np.uint8)
-        image = cv2.imdecode(stream, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            raise FileNotFoundError(f"Bad image: {path}")
-
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if self.cache is not None:
+            image = self.cache[idx]
+        else:
+            image = self.load_image(path)
         
         # Augment
         if self.transform:
@@ -0,0 +1,76 @@
+import os
+import math
+import logging
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+from src.config import TRAIN_DIST_BACKEND, TRAIN_THREADS
+
+logger = logging.getLogger(__name__)
+
+
+def setup(threads=None):
+    """
+    Join the process group when launched by torchrun (WORLD_SIZE > 1) and
+    size torch's intra-op pool. torchrun pins OMP_NUM_THREADS to 1, which
+    leaves most cores idle on CPU; by default each local rank gets an even
+    share of the machine's cores instead. Returns (rank, world_size).
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    local_world = int(os.environ.get("LOCAL_WORLD_SIZE", "1"))
+
+    threads = threads or TRAIN_THREADS or max(1, (os.cpu_count() or 1) // local_world)
+    torch.set_num_threads(threads)
+
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group(backend=TRAIN_DIST_BACKEND)
+    rank = dist.get_rank() if dist.is_initialized() else 0
+    if rank == 0:
+        logger.info(f"World size {world_size} ({TRAIN_DIST_BACKEND}), {threads} intra-op threads per rank")
+    return rank, world_size
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_initialized() and dist.get_world_size() > 1
+
+
+def is_main():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def all_reduce_sum(tensor):
+    """Sum a tensor over ranks in place (no-op when running alone)."""
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+class ShardSampler(Sampler):
+    """
+    Contiguous, unpadded shard of a dataset for one rank, in order. Unlike
+    DistributedSampler, nothing is repeated to even out the shards, so
+    summed validation metrics count every slice exactly once.
+    """
+
+    def __init__(self, dataset, rank=None, world_size=None):
+        self.rank = dist.get_rank() if rank is None else rank
+        self.world_size = dist.get_world_size() if world_size is None else world_size
+        per_rank = math.ceil(len(dataset) / self.world_size)
+        self.start = min(self.rank * per_rank, len(dataset))
+        self.end = min(self.start + per_rank, len(dataset))
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
@@ -1,47 +1,82 @@
-import torch
+import time
+import argparse
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.metrics import confusion_matrix, classification_report
-import pandas as pd
+from sklearn.metrics import classification_report
 from src.training.dataset import NeuroSiftDataset
+from src.training.train_model import make_loader
 from src.inference.predictor import ModelPredictor
-from torch.utils.data import DataLoader
-import os
-
-def evaluate_model():
-    # Load Dataset
-    dataset = NeuroSiftDataset(target_classes=["T1", "T2", "FLAIR"])
-    # No transform needed for raw pixel access if we use predictor, 
-    # but predictor handles opening.
-    # Actually, let's use the dataset's logical structure but let predictor handle inference to match prod.
-    
-    predictor = ModelPredictor()
-    if not predictor.model:
-        return
-
-    y_true = []
-    y_pred = []
-    
+from src.config import INPUT_SIZE
+
+
+def evaluate_batches(predictor, loader, labels):
+    """
+    Run every batch of loader through predictor.predict_batch and yield
+    (slices seen, confusion matrix so far) after each one. The matrix
+    (rows = true, columns = predicted) is updated in place, so partial
+    metrics are available at any point without keeping per-slice results.
+    """
+    label_idx = {label: i for i, label in enumerate(labels)}
+    cm = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    seen = 0
+    for images, targets in loader:
+        results = predictor.predict_batch(list(images.numpy()), batch_size=len(images))
+        pairs = [
+            (target, label_idx[res["label"]])
+            for target, res in zip(targets.tolist(), results)
+            if res and "error" not in res
+        ]
+        if pairs:
+            true, pred = zip(*pairs)
+            np.add.at(cm, (list(true), list(pred)), 1)
+        seen += len(results)
+        yield seen, cm
+
+
+def metrics_report(cm, labels):
+    """sklearn's classification report for a confusion matrix (one weighted sample per cell)."""
+    true, pred = np.nonzero(cm)
+    return classification_report(
+        true, pred, labels=range(len(labels)), target_names=labels,
+        sample_weight=cm[true, pred], zero_division=0
+    )
+
+
+def evaluate_model(split="test", model_path="models/neurosift_resnet18.pth", backend=None,
+                   batch_size=64, num_workers=None, log_every=10):
+    """
+    Streaming evaluation: a DataLoader decodes INPUT_SIZE-tier slices in
+    worker processes and each batch goes through the predictor's public
+    predict_batch, so preprocessing and the forward pass are exactly prod's.
+    The confusion matrix is updated per batch and running accuracy and
+    per-class recall are logged as it goes. Returns the confusion matrix
+    (rows = true, columns = predicted).
+    """
+    # Prediction cache on: a repeat evaluation of the same model only decodes and hashes
+    predictor = ModelPredictor(model_path, backend=backend)
+    if predictor.model is None:
+        return None
+    labels = predictor.classes
+
+    dataset = NeuroSiftDataset(split=split, target_classes=labels, image_size=INPUT_SIZE)
+    loader = make_loader(dataset, False, predictor.device, batch_size=batch_size, num_workers=num_workers)
+
     print(f"Evaluating on {len(dataset)} images...")
-    
-    for i in range(len(dataset)):
-        item = dataset.data_index[i]
-        path = item["path"]
-        true_label = item["label"]
-        
-        # Predict
-        res = predictor.predict(path)
-        if res:
-            y_true.append(true_label)
-            y_pred.append(res['label'])
-            
-        if i % 100 == 0:
-            print(f"Processed {i}...")
-
-    # Confusion Matrix
-    labels = ["T1", "T2", "FLAIR"]
-    cm = confusion_matrix(y_true, y_pred, labels=labels)
-    
+    since = time.perf_counter()
+    seen = 0
+    cm = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    for step, (seen, cm) in enumerate(evaluate_batches(predictor, loader, labels), 1):
+        if step % log_every == 0:
+            elapsed = time.perf_counter() - since
+            recall = np.diag(cm) / np.maximum(cm.sum(axis=1), 1)
+            per_class = ", ".join(f"{label} {r:.3f}" for label, r in zip(labels, recall))
+            print(f"Processed {seen}/{len(dataset)}: running acc {np.trace(cm) / max(cm.sum(), 1):.4f}, "
+                  f"recall {per_class}, {seen / elapsed:.1f} slices/s")
+
+    elapsed = max(time.perf_counter() - since, 1e-9)
+    print(f"Evaluated {seen} slices in {elapsed:.1f}s ({seen / elapsed:.1f} slices/s)")
+
     # Plot
     plt.figure(figsize=(8, 6))
     sns.heatmap(cm, annot=True, fmt='d', xticklabels=labels, yticklabels=labels, cmap='Blues')
@@ -50,11 +85,22 @@ def evaluate_model():
     plt.title('Confusion Matrix - NeuroSift Modality Classification')
     plt.savefig('confusion_matrix.png')
     print("Confusion Matrix saved to confusion_matrix.png")
-    
+
     # Report
-    report = classification_report(y_true, y_pred, target_names=labels)
     print("\nClassification Report:")
-    print(report)
+    if cm.sum():
+        print(metrics_report(cm, labels))
+    else:
+        print("No slices were classified")
+    return cm
 
 if __name__ == "__main__":
-    evaluate_model()
+    parser = argparse.ArgumentParser(description="Batched evaluation on a patient split")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--model", default="models/neurosift_resnet18.pth", help="Path, version tag or \"latest\"")
+    parser.add_argument("--backend", default=None)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    evaluate_model(args.split, args.model, args.backend, args.batch_size, args.workers)
@@ -0,0 +1,68 @@
+import torch
+import torch.nn as nn
+from torchvision import models, transforms
+
+# ImageNet stats used by the original 3-channel checkpoints
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+# Single-channel stats for grayscale slices (the channel averages of the above)
+GRAY_MEAN = [0.449]
+GRAY_STD = [0.226]
+
+
+def to_single_channel(model):
+    """
+    Replace ResNet's RGB stem with a 1-channel conv whose filters are the
+    pretrained ones summed over the colour axis. That matches the RGB stem
+    only for an input that is identical in all 3 channels after
+    normalization, i.e. with one mean/std for every channel; ImageNet's
+    per-channel mean/std break it, so this is a close initialization to
+    fine-tune from, not the same function.
+    """
+    old = model.conv1
+    conv = nn.Conv2d(
+        1, old.out_channels,
+        kernel_size=old.kernel_size,
+        stride=old.stride,
+        padding=old.padding,
+        bias=old.bias is not None
+    )
+    with torch.no_grad():
+        conv.weight.copy_(old.weight.sum(dim=1, keepdim=True))
+        if old.bias is not None:
+            conv.bias.copy_(old.bias)
+    model.conv1 = conv
+    return model
+
+
+def build_model(num_classes, in_channels=1, pretrained=True):
+    """ResNet18 classifier for in_channels=1 (grayscale) or 3 (legacy RGB)."""
+    weights = models.ResNet18_Weights.IMAGENET1K_V1 if pretrained else None
+    model = models.resnet18(weights=weights)
+    if in_channels == 1:
+        model = to_single_channel(model)
+    num_ftrs = model.fc.in_features
+    model.fc = nn.Linear(num_ftrs, num_classes)
+    return model
+
+
+def checkpoint_in_channels(state_dict):
+    """1 for grayscale checkpoints, 3 for the original RGB ones."""
+    return state_dict["conv1.weight"].shape[1]
+
+
+class ExpandChannels:
+    """Broadcast a (1, H, W) tensor to (3, H, W) for legacy RGB models."""
+
+    def __call__(self, tensor):
+        return tensor.expand(3, -1, -1)
+
+
+def normalize(in_channels):
+    """Normalization for a (1, H, W) gray tensor feeding an in_channels model."""
+    if in_channels == 1:
+        return transforms.Normalize(GRAY_MEAN, GRAY_STD)
+    return transforms.Compose([
+        ExpandChannels(),
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)
+    ])
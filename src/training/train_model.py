@@ -2,103 +2,281 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader
-from torchvision import transforms, models
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
 from src.training.dataset import NeuroSiftDataset
+from src.training.model import build_model
+from src.training.augment import BatchAugment, BatchTransform
+from src.training import distributed, checkpoint
+from src.instrumentation import timer
+from src.config import (
+    TRAIN_NUM_WORKERS, TRAIN_PREFETCH_FACTOR, TRAIN_PERSISTENT_WORKERS, TRAIN_PIN_MEMORY, TRAIN_SLICE_CACHE,
+    TRAIN_PATIENCE, TRAIN_CHECKPOINT_EVERY
+)
+import cv2
 import logging
 import time
-import copy
 import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def train_model(num_epochs=10):
+def _worker_init(worker_id):
+    # Each worker decodes on one thread; parallelism comes from the workers
+    cv2.setNumThreads(1)
+
+
+def make_loader(dataset, shuffle, device, batch_size=32, num_workers=None, sampler=None):
+    """DataLoader tuned for throughput: worker processes, prefetch, pinned batches on CUDA."""
+    num_workers = TRAIN_NUM_WORKERS if num_workers is None else num_workers
+    options = {}
+    if num_workers > 0:
+        options = {
+            "persistent_workers": TRAIN_PERSISTENT_WORKERS,
+            "prefetch_factor": TRAIN_PREFETCH_FACTOR,
+            "worker_init_fn": _worker_init,
+        }
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=TRAIN_PIN_MEMORY and device.type == "cuda",
+        **options
+    )
+
+
+def train_model(num_epochs=10, in_channels=1, num_workers=None, cache=None, threads=None,
+                model_path="models/neurosift_resnet18.pth", tag=None, resume=None, patience=None,
+                checkpoint_every=None):
+    """
+    Single process, or DistributedDataParallel when launched with torchrun
+    (gloo by default, so CPU processes on one or several nodes):
+
+        torchrun --standalone --nproc_per_node=4 -m src.training.train_model
+
+    Each rank trains on its DistributedSampler shard of the train split
+    and validates on an unpadded shard of the test split; the patient-level
+    splits are applied before sharding, so no patient crosses splits. Loss
+    and accuracy are summed across ranks, and only rank 0 logs and writes
+    the checkpoint. Every rank keeps its own decoded-slice cache; with many
+    ranks per node, --no-cache trades that RAM for decode time.
+
+    Each run is a version under MODEL_VERSIONS_DIR/<tag> (a timestamp by
+    default): checkpoint.pt holds model, optimizer, epoch and RNG state
+    every checkpoint_every epochs, model.pth the best weights so far. Both
+    are written by a background thread. resume=True continues the most
+    recent checkpoint, resume=<tag> that version's. Training stops early
+    after patience epochs without a better val accuracy, and the best
+    weights are published to model_path at the end.
+    """
+    rank, world_size = distributed.setup(threads)
+    main = distributed.is_main()
+
     # Device
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    logger.info(f"Device: {device}")
+    if torch.cuda.is_available():
+        device = torch.device(f"cuda:{int(os.environ.get('LOCAL_RANK', '0'))}")
+    else:
+        device = torch.device("cpu")
+    if main:
+        logger.info(f"Device: {device}")
+    cache = TRAIN_SLICE_CACHE if cache is None else cache
     
-    # Augmentations
-    data_transforms = transforms.Compose([
-        transforms.ToPILImage(),
-        transforms.Resize((224, 224)),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomRotation(10),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
+    # Augmentations: slices are resized once on load and collated as uint8;
+    # flip / rotation / normalization then run on whole batches. Validation
+    # is deterministic. in_channels 1 = native grayscale, 3 = legacy RGB model
+    batch_transforms = {
+        'train': BatchAugment(in_channels, flip_p=0.5, degrees=10).to(device),
+        'val': BatchTransform(in_channels).to(device)
+    }
     
     # Data loaders
-    train_dataset = NeuroSiftDataset(split="train", transform=data_transforms, target_classes=["T1", "T2", "FLAIR"])
-    val_dataset = NeuroSiftDataset(split="test", transform=data_transforms, target_classes=["T1", "T2", "FLAIR"])
+    train_dataset = NeuroSiftDataset(split="train", target_classes=["T1", "T2", "FLAIR"], cache=cache, image_size=224)
+    val_dataset = NeuroSiftDataset(split="test", target_classes=["T1", "T2", "FLAIR"], cache=cache, image_size=224)
     class_names = train_dataset.classes
     
+    samplers = {'train': None, 'val': None}
+    if world_size > 1:
+        samplers = {
+            'train': DistributedSampler(train_dataset, shuffle=True),
+            'val': distributed.ShardSampler(val_dataset),
+        }
     dataloaders = {
-        'train': DataLoader(train_dataset, batch_size=32, shuffle=True, num_workers=0),
-        'val': DataLoader(val_dataset, batch_size=32, shuffle=False, num_workers=0)
+        'train': make_loader(train_dataset, True, device, num_workers=num_workers, sampler=samplers['train']),
+        'val': make_loader(val_dataset, False, device, num_workers=num_workers, sampler=samplers['val'])
     }
+    non_blocking = dataloaders['train'].pin_memory
     
     # ResNet18
-    model = models.resnet18(weights=models.ResNet18_Weights.IMAGENET1K_V1)
-    num_ftrs = model.fc.in_features
-    model.fc = nn.Linear(num_ftrs, len(class_names))
-    model = model.to(device)
+    bare = build_model(len(class_names), in_channels=in_channels)
+    bare = bare.to(device)
     
     criterion = nn.CrossEntropyLoss()
-    optimizer = optim.SGD(model.parameters(), lr=0.001, momentum=0.9)
+    optimizer = optim.SGD(bare.parameters(), lr=0.001, momentum=0.9)
     
-    # Training Loop
-    since = time.time()
-    best_model_wts = copy.deepcopy(model.state_dict())
+    # Checkpoints and resume
+    patience = TRAIN_PATIENCE if patience is None else patience
+    checkpoint_every = checkpoint_every or TRAIN_CHECKPOINT_EVERY
+    tag = tag or time.strftime("%Y%m%d-%H%M%S")
+    start_epoch = 0
     best_acc = 0.0
+    bad_epochs = 0 # Epochs since val accuracy last improved
+    if resume:
+        # Every rank loads the same state (DDP also broadcasts rank 0's weights on wrap)
+        path = checkpoint.latest_checkpoint() if resume is True else os.path.join(
+            checkpoint.version_dir(resume), checkpoint.CHECKPOINT_FILE)
+        if path and os.path.exists(path):
+            state = checkpoint.restore(path, bare, optimizer)
+            start_epoch = state["epoch"] + 1
+            best_acc = state["best_acc"]
+            bad_epochs = state["bad_epochs"]
+            tag = state["tag"]
+        elif main:
+            logger.warning(f"No checkpoint to resume from ({resume}), starting from scratch")
+    run_dir = checkpoint.version_dir(tag)
+    writer = None
+    if main:
+        os.makedirs(run_dir, exist_ok=True)
+        writer = checkpoint.CheckpointWriter()
+        logger.info(f"Version {tag}: {run_dir}")
     
-    for epoch in range(num_epochs):
-        logger.info(f'Epoch {epoch}/{num_epochs - 1}')
+    model = bare
+    if world_size > 1:
+        model = DistributedDataParallel(bare, device_ids=[device.index] if device.type == "cuda" else None)
+    # Validation shards can differ by a batch, so eval bypasses DDP's collectives
+    nets = {'train': model, 'val': bare}
+    
+    # Training Loop
+    try:
+        since = time.time()
+    
+        for epoch in range(start_epoch, num_epochs):
+            if main:
+                logger.info(f'Epoch {epoch}/{num_epochs - 1}')
+            if samplers['train'] is not None:
+                samplers['train'].set_epoch(epoch) # New shuffle per epoch, same on every rank
         
-        for phase in ['train', 'val']:
-            if phase == 'train':
-                model.train()
-            else:
-                model.eval()
+            for phase in ['train', 'val']:
+                if phase == 'train':
+                    model.train()
+                else:
+                    model.eval()
                 
-            running_loss = 0.0
-            running_corrects = 0
+                # Loss sum, correct predictions, samples: kept on the device, synced once per epoch
+                totals = torch.zeros(3, dtype=torch.float64, device=device)
+                data_time = 0.0 # Waiting on the loader
+                compute_time = 0.0 # Copy, batch augmentation, forward, backward, step
+                steps = 0
             
-            for inputs, labels in dataloaders[phase]:
-                inputs = inputs.to(device)
-                labels = labels.to(device)
+                tick = time.perf_counter()
+                for inputs, labels in dataloaders[phase]:
+                    loaded = time.perf_counter()
+                    data_time += loaded - tick
                 
-                optimizer.zero_grad()
+                    inputs = inputs.to(device, non_blocking=non_blocking)
+                    labels = labels.to(device, non_blocking=non_blocking)
+                    inputs = batch_transforms[phase](inputs)
                 
-                with torch.set_grad_enabled(phase == 'train'):
-                    outputs = model(inputs)
-                    _, preds = torch.max(outputs, 1)
-                    loss = criterion(outputs, labels)
+                    optimizer.zero_grad()
+                
+                    # On CUDA these time kernel launches, not kernels
+                    with torch.set_grad_enabled(phase == 'train'):
+                        with timer(f"{phase}_forward"):
+                            outputs = nets[phase](inputs)
+                            _, preds = torch.max(outputs, 1)
+                            loss = criterion(outputs, labels)
                     
-                    if phase == 'train':
-                        loss.backward()
-                        optimizer.step()
+                        if phase == 'train':
+                            with timer("train_backward"):
+                                loss.backward() # DDP all-reduces gradients here
+                                optimizer.step()
                         
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
+                    totals[0] += loss.detach() * inputs.size(0)
+                    totals[1] += (preds == labels).sum()
+                    totals[2] += inputs.size(0)
+                
+                    tick = time.perf_counter()
+                    compute_time += tick - loaded
+                    steps += 1
                 
-            epoch_loss = running_loss / len(dataloaders[phase].dataset)
-            epoch_acc = running_corrects.double() / len(dataloaders[phase].dataset)
+                loss_sum, corrects, seen = distributed.all_reduce_sum(totals).tolist()
+                epoch_loss = loss_sum / max(seen, 1)
+                epoch_acc = corrects / max(seen, 1)
             
-            logger.info(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+                if main:
+                    logger.info(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+                    if steps:
+                        logger.info(
+                            f'{phase} data wait {1000 * data_time / steps:.1f} ms/step, '
+                            f'compute {1000 * compute_time / steps:.1f} ms/step '
+                            f'({data_time / max(data_time + compute_time, 1e-9):.0%} waiting on data)'
+                        )
             
-            if phase == 'val' and epoch_acc > best_acc:
-                best_acc = epoch_acc
-                best_model_wts = copy.deepcopy(model.state_dict())
+                # Every rank sees the same reduced accuracy, so they agree on "best" and on stopping
+                if phase == 'val':
+                    if epoch_acc > best_acc:
+                        best_acc = epoch_acc
+                        bad_epochs = 0
+                        if main:
+                            save_best(writer, bare, run_dir, tag, epoch, best_acc, class_names, in_channels)
+                    else:
+                        bad_epochs += 1
+        
+            stop = patience > 0 and bad_epochs >= patience
+            if main and ((epoch + 1) % checkpoint_every == 0 or stop or epoch == num_epochs - 1):
+                progress = {"best_acc": best_acc, "bad_epochs": bad_epochs, "tag": tag}
+                writer.save(checkpoint.capture(bare, optimizer, epoch, progress),
+                            os.path.join(run_dir, checkpoint.CHECKPOINT_FILE))
+            if stop:
+                if main:
+                    logger.info(f'No val improvement for {bad_epochs} epochs, stopping early')
+                break
                 
-    # Save
-    time_elapsed = time.time() - since
-    logger.info(f'Training complete in {time_elapsed // 60:.0f}m {time_elapsed % 60:.0f}s')
-    logger.info(f'Best val Acc: {best_acc:4f}')
-    
-    model.load_state_dict(best_model_wts)
-    os.makedirs("models", exist_ok=True)
-    torch.save(model.state_dict(), "models/neurosift_resnet18.pth")
-    logger.info("Model saved")
+        time_elapsed = time.time() - since
+        if main:
+            logger.info(f'Training complete in {time_elapsed // 60:.0f}m {time_elapsed % 60:.0f}s')
+            logger.info(f'Best val Acc: {best_acc:4f}')
+            best_path = os.path.join(run_dir, checkpoint.MODEL_FILE)
+            if best_acc == 0.0:
+                # Nothing ever improved (e.g. empty val split): keep the last weights
+                save_best(writer, bare, run_dir, tag, num_epochs - 1, best_acc, class_names, in_channels)
+    finally:
+        if writer is not None:
+            writer.close() # Waits for pending writes, also when training fails
+    if main:
+        checkpoint.publish(best_path, model_path)
+        logger.info(f"Model {tag} published to {model_path}")
+    distributed.barrier()
+    distributed.cleanup()
+
+
+def save_best(writer, model, run_dir, tag, epoch, val_acc, classes, in_channels):
+    """Queue the best weights (a bare state dict, loadable by ModelPredictor) and their metadata."""
+    writer.save(checkpoint.to_cpu(model.state_dict()), os.path.join(run_dir, checkpoint.MODEL_FILE))
+    writer.submit(checkpoint.atomic_json, {
+        "tag": tag,
+        "epoch": epoch,
+        "val_acc": val_acc,
+        "classes": classes,
+        "in_channels": in_channels,
+        "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }, os.path.join(run_dir, checkpoint.META_FILE))
 
 if __name__ == "__main__":
-    train_model(num_epochs=5)
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the NeuroSift modality classifier")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="DataLoader workers (0 = in-process)")
+    parser.add_argument("--no-cache", action="store_true", help="Decode from disk on every access")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads per process")
+    parser.add_argument("--tag", default=None, help="Version name (default: a timestamp)")
+    parser.add_argument("--resume", nargs="?", const=True, default=None,
+                        help="Continue the latest checkpoint, or the given version's")
+    parser.add_argument("--patience", type=int, default=None, help="Early stopping epochs (0 = off)")
+    parser.add_argument("--checkpoint-every", type=int, default=None, help="Epochs between checkpoints")
+    args = parser.parse_args()
+
+    train_model(num_epochs=args.epochs, num_workers=args.workers, cache=False if args.no_cache else None,
+                threads=args.threads, tag=args.tag, resume=args.resume, patience=args.patience,
+                checkpoint_every=args.checkpoint_every)
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+
+def write_series(raw_dir, dirname, patient_id, description="AX T1", n=3, size=32, series_uid=None):
+    """Write a synthetic MR series of n slices to raw_dir/dirname; returns its SeriesInstanceUID."""
+    series_dir = os.path.join(raw_dir, dirname)
+    os.makedirs(series_dir, exist_ok=True)
+    series_uid = series_uid or generate_uid()
+    for i in range(n):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = MRImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.PatientID = patient_id
+        ds.Modality = "MR"
+        ds.SeriesInstanceUID = series_uid
+        ds.SeriesDescription = description
+        ds.InstanceNumber = i + 1
+        ds.Rows = ds.Columns = size
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 0
+        ds.PixelData = (np.random.rand(size, size) * 1000 + 1).astype(np.uint16).tobytes()
+        ds.save_as(os.path.join(series_dir, f"{i:03d}.dcm"), enforce_file_format=True)
+    return series_uid
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, so the SQLite catalog (neurosift.db) is a fresh file."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def make_processor(workdir):
+    """DicomProcessor factory reading workdir/raw/dicom and writing workdir/processed."""
+    from src.processing.dicom_processor import DicomProcessor
+
+    raw_dir = os.path.join(workdir, "raw", "dicom")
+    os.makedirs(raw_dir, exist_ok=True)
+
+    def make(backend="png"):
+        proc = DicomProcessor(backend=backend)
+        proc.raw_dir = proc.index.raw_dir = raw_dir
+        proc.processed_dir = os.path.join(workdir, "processed")
+        os.makedirs(proc.processed_dir, exist_ok=True)
+        return proc
+    return make
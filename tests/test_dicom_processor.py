@@ -0,0 +1,132 @@
+import os
+import cv2
+import numpy as np
+from src.collector.metadata_store import ImageMetadata, SourceManifest
+from src.processing.series_index import list_dicom_files
+from tests.conftest import write_series
+
+
+def legacy_run(proc):
+    """What DicomProcessor.run wrote before the source manifest: walk-order names, absolute paths."""
+    rows = []
+    for count, path in enumerate(list_dicom_files(proc.raw_dir), start=1):
+        img, ds = proc.read_dicom(path)
+        name = f"{ds.PatientID}_{ds.SeriesInstanceUID[-5:]}_{count}.png"
+        out_path = os.path.join(proc.processed_dir, name)
+        cv2.imwrite(out_path, proc.apply_window(img))
+        rows.append({"pmc_id": ds.PatientID, "graphic_id": name, "s3_key": out_path, "modality": "MR", "is_valid": 1})
+    with proc.store.engine.begin() as conn:
+        conn.execute(ImageMetadata.__table__.insert(), rows)
+    return len(rows)
+
+
+def catalog(proc):
+    session = proc.store.Session()
+    try:
+        return session.query(ImageMetadata).order_by(ImageMetadata.id).all()
+    finally:
+        session.close()
+
+
+def test_incremental_run_adopts_legacy_catalog(make_processor):
+    proc = make_processor()
+    uid = write_series(proc.raw_dir, "s1", "PAT-00", n=3)
+    write_series(proc.raw_dir, "s2", "PAT-01", n=2)
+    assert legacy_run(proc) == 5
+
+    # The labeler ran on the legacy catalog
+    with proc.store.engine.begin() as conn:
+        conn.execute(ImageMetadata.__table__.update().where(ImageMetadata.pmc_id == "PAT-00").values(modality="T1"))
+
+    assert proc.run(workers=1, incremental=True) == 0
+
+    rows = catalog(proc)
+    assert len(rows) == 5
+    assert len(os.listdir(proc.processed_dir)) == 5
+    pat00 = [r for r in rows if r.pmc_id == "PAT-00"]
+    assert [r.modality for r in pat00] == ["T1"] * 3
+    assert {r.series_uid for r in pat00} == {uid}
+    assert sorted(r.instance_number for r in pat00) == [1, 2, 3]
+
+    session = proc.store.Session()
+    try:
+        assert session.query(SourceManifest).count() == 5
+    finally:
+        session.close()
+
+
+def test_shifted_legacy_rows_are_replaced(make_processor):
+    proc = make_processor()
+    write_series(proc.raw_dir, "s1", "PAT-00", n=3)
+    legacy_run(proc)
+    # Removing a file moves the walk position of the ones after it
+    os.remove(os.path.join(proc.raw_dir, "s1", "001.dcm"))
+
+    proc.run(workers=1, incremental=True)
+
+    rows = catalog(proc)
+    assert len(rows) == 2
+    assert sorted(os.path.basename(r.s3_key) for r in rows) == sorted(os.listdir(proc.processed_dir))
+    session = proc.store.Session()
+    try:
+        manifest = {m.output_key: m.path for m in session.query(SourceManifest)}
+    finally:
+        session.close()
+    # Every slice left shows the file the manifest says it came from
+    for r in rows:
+        img, ds = proc.read_dicom(proc.index.abspath(manifest[r.graphic_id]))
+        assert np.array_equal(cv2.imread(r.s3_key, cv2.IMREAD_UNCHANGED), proc.apply_window(img))
+
+
+def test_reprocessing_a_patient_keeps_labels_and_predictions(make_processor):
+    proc = make_processor()
+    write_series(proc.raw_dir, "s1", "PAT-00", n=3)
+    write_series(proc.raw_dir, "s2", "PAT-01", n=2)
+    assert proc.run(workers=1) == 5
+    with proc.store.engine.begin() as conn:
+        conn.execute(ImageMetadata.__table__.update().values(
+            modality="T1", predicted_label="T1", predicted_confidence=0.9, predicted_model="abc"
+        ))
+    ids = {r.graphic_id: r.id for r in catalog(proc)}
+
+    assert proc.process_patients(["PAT-00"], workers=1, incremental=False) == 3
+
+    rows = catalog(proc)
+    assert {r.graphic_id: r.id for r in rows} == ids
+    assert {(r.modality, r.predicted_label, r.predicted_model) for r in rows} == {("T1", "T1", "abc")}
+
+
+def test_renamed_slice_takes_over_labels(make_processor):
+    proc = make_processor()
+    uid = write_series(proc.raw_dir, "s1", "PAT-00", n=2)
+    legacy_run(proc)
+    with proc.store.engine.begin() as conn:
+        conn.execute(ImageMetadata.__table__.update().values(modality="FLAIR"))
+    proc.run(workers=1)
+    # Changed pixels under a legacy name: reconverted under the new naming scheme
+    write_series(proc.raw_dir, "s1", "PAT-00", n=2, series_uid=uid)
+
+    assert proc.run(workers=1) == 2
+
+    rows = catalog(proc)
+    assert len(rows) == 2
+    assert [r.modality for r in rows] == ["FLAIR", "FLAIR"]
+    assert len(os.listdir(proc.processed_dir)) == 2
+
+
+def test_changed_source_removes_its_old_volume(make_processor):
+    proc = make_processor(backend="npy")
+    uid = write_series(proc.raw_dir, "s1", "PAT-00", n=3, size=160)
+    assert proc.run(workers=1) == 3
+    volume_dir = os.path.join(proc.processed_dir, "volumes")
+    old = sorted(os.listdir(volume_dir))
+    assert "t128" in old and len(old) == 2
+
+    # PatientID fixed upstream: same files, new volume name
+    write_series(proc.raw_dir, "s1", "PAT-01", n=3, size=160, series_uid=uid)
+    assert proc.run(workers=1) == 3
+
+    volumes = sorted(f for f in os.listdir(volume_dir) if f.endswith(".npy"))
+    assert len(volumes) == 1 and volumes[0].startswith("PAT-01_")
+    assert os.listdir(os.path.join(volume_dir, "t128")) == volumes
+    assert {r.s3_key.split("#")[0] for r in catalog(proc)} == {os.path.join(volume_dir, volumes[0])}